@@ -1,14 +1,62 @@
+import os
+import io
+import csv
 import json
+import hashlib
+import logging
+import time
+import sqlite3
+import threading
 import calendar
-from flask import Flask, render_template, redirect, url_for, request, flash
+import heapq
+import click
+from collections import OrderedDict, defaultdict
+from bisect import bisect_left
+from itertools import islice
+from flask import Flask, Response, stream_with_context, make_response, session, render_template, redirect, url_for, request, flash, jsonify, abort, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, case, literal, select, update, delete, insert, union_all, event, inspect, text, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn, CreateTable
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import aliased, joinedload, selectinload, contains_eager
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from datetime import datetime, timedelta
+from werkzeug.http import is_resource_modified
+from datetime import datetime, timedelta, timezone
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sekretny_klucz_v18_fixing_breaks_and_next_slot'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['BOOKING_LOOKAHEAD_DAYS'] = 14 # ile dni do przodu szukamy wolnego terminu
+app.config['AVAILABILITY_MAX_DAYS'] = 366 # maksymalne okno /api/availability
+app.config['EARLIEST_SLOTS_LIMIT'] = 10 # ile terminow pokazuje "pierwszy wolny termin"
+app.config['EMPLOYEE_REVIEWS_SHOWN'] = 20 # ile najnowszych opinii pracownika laduje okno opinii przy wyborze pracownika
+# Cache grafikow: 'memory' (osobny w kazdym procesie) albo 'sqlite:///schedule_cache.db' (wspolny dla workerow)
+app.config['SCHEDULE_CACHE'] = os.environ.get('SCHEDULE_CACHE', 'memory')
+app.config['SCHEDULE_CACHE_SIZE'] = 2048 # maks. liczba pracownikow w cache
+app.config['SCHEDULE_CACHE_TTL'] = 300 # sekundy
+# Cache fragmentow stron rezerwacji (booking_date, booking_salon) i wersji danych - backendy jak SCHEDULE_CACHE
+app.config['PAGE_CACHE'] = os.environ.get('PAGE_CACHE', 'memory')
+app.config['PAGE_CACHE_SIZE'] = 512 # maks. liczba fragmentow
+app.config['PAGE_CACHE_TTL'] = 300 # sekundy; przy 'memory' tyle najdluzej inny worker pokazuje stare dane
+app.config['CAPACITY_FEW_MIN'] = 120 # dzien z mniejsza suma wolnych minut calej obsady oznaczany jako "malo terminow"
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = 5000 # ile SQLite czeka na zwolnienie blokady zapisu
+app.config['BOOKING_ALTERNATIVES'] = 3 # ile najblizszych godzin proponujemy, gdy termin zostal zajety
+app.config['BULK_SCHEDULE_MAX_DAYS'] = 366 # maksymalny zakres grafiku hurtowego
+app.config['ADMIN_PAGE_SIZE'] = 50 # wierszy na strone w tabelach panelu admina
+app.config['CLIENT_PAGE_SIZE'] = 20 # wizyt na strone w panelu klienta
+app.config['EXPORT_BATCH'] = 1000 # wierszy pobieranych z bazy naraz przy eksporcie
+app.config['ARCHIVE_AFTER_DAYS'] = 365 # zrealizowane/odrzucone wizyty starsze niz tyle dni ida do archiwum
+app.config['ARCHIVE_BATCH'] = 1000 # wizyt przenoszonych w jednej transakcji
+app.config['LIFECYCLE_EXPIRE_GRACE_MIN'] = 0 # niepotwierdzone prosby/propozycje wygasaja tyle minut po poczatku wizyty
+app.config['LIFECYCLE_COMPLETE_GRACE_MIN'] = 60 # potwierdzone wizyty sa zamykane jako zrealizowane tyle minut po koncu
+app.config['LIFECYCLE_BATCH'] = 500 # wizyt w jednym UPDATE
+app.config['LIFECYCLE_INTERVAL_S'] = int(os.environ.get('LIFECYCLE_INTERVAL_S', 0)) # >0: watek w tle co tyle sekund; 0: tylko `flask lifecycle`
+app.config['PROFILING'] = os.environ.get('PROFILING') == '1' # pomiary zadan i SQL + /metrics; wylaczone = zero podpietych hookow
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100)) # zapytania wolniejsze od progu trafiaja do logu 'app.sql'
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
@@ -17,17 +65,25 @@ login_manager.login_view = 'login'
 
 # --- MODELE BAZY DANYCH ---
 
-class User(UserMixin, db.Model):
+class RatingCounters:
+    """Zdenormalizowane oceny (suma i liczba) - utrzymywane przy dodaniu/usunieciu Review, przeliczane przez `flask rebuild-ratings`."""
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @property
+    def avg_rating(self): return round(self.rating_sum / self.rating_count if self.rating_count else 0, 1)
+
+class User(RatingCounters, UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
     role = db.Column(db.String(50), nullable=False) 
-    salon_id = db.Column(db.Integer, db.ForeignKey('salon.id'), nullable=True)
+    salon_id = db.Column(db.Integer, db.ForeignKey('salon.id'), nullable=True, index=True)
     work_days = db.Column(db.String(20), default="0,1,2,3,4")
     breaks_json = db.Column(db.String(1000), default="{}")
-    reviews_received = db.relationship('Review', foreign_keys='Review.employee_id', backref='employee_reviewed', lazy=True)
+    reviews_received = db.relationship('Review', foreign_keys='Review.employee_id', backref='employee_reviewed', cascade="all, delete-orphan", lazy=True)
 
-class Salon(db.Model):
+class Salon(RatingCounters, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(200), nullable=False)
@@ -44,7 +100,7 @@ class Service(db.Model):
     name = db.Column(db.String(100), nullable=False)
     duration = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
-    salon_id = db.Column(db.Integer, db.ForeignKey('salon.id'), nullable=False)
+    salon_id = db.Column(db.Integer, db.ForeignKey('salon.id'), nullable=False, index=True)
 
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -53,14 +109,23 @@ class Review(db.Model):
     created_at = db.Column(db.String(20), default=lambda: datetime.now().strftime("%Y-%m-%d"))
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), unique=True, nullable=False)
     client_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+def minutes_as_hhmm(attr):
+    """Kolumna z minuta doby widziana jako tekst HH:MM - odczyt, zapis i wyrazenie SQL (sortowanie, porownania)."""
+    def get(self): return fmt_opt(getattr(self, attr))
+    def set(self, value): setattr(self, attr, to_min(value) if value else None)
+    return hybrid_property(get, set, expr=lambda cls: getattr(cls, attr))
+
+LIFECYCLE_STATUSES = ['oczekuje', 'zmiana_terminu', 'potwierdzona'] # statusy przegladane przez run_lifecycle
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.String(50), nullable=False)
-    time = db.Column(db.String(50), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    start_min = db.Column(db.Integer, nullable=False) # minuta doby
+    time = minutes_as_hhmm('start_min')
     status = db.Column(db.String(20), default="oczekuje")
-    proposed_date = db.Column(db.String(50), nullable=True)
+    proposed_date = db.Column(db.Date, nullable=True)
     proposed_time = db.Column(db.String(50), nullable=True)
     client_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     employee_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -70,18 +135,88 @@ class Appointment(db.Model):
     employee = db.relationship('User', foreign_keys=[employee_id])
     client = db.relationship('User', foreign_keys=[client_id])
     review_obj = db.relationship('Review', backref='appointment', uselist=False, cascade="all, delete-orphan")
+    archived = False
+    __table_args__ = (db.Index('ix_appointment_employee_date_status', 'employee_id', 'date', 'status'),
+                      db.Index('ix_appointment_salon_status', 'salon_id', 'status'),
+                      db.Index('ix_appointment_client_date', 'client_id', 'date'),
+                      # Czesciowy: tylko statusy przegladane przez run_lifecycle, zeby nie konkurowal z indeksami raportow po 'zrealizowana'
+                      db.Index('ix_appointment_lifecycle', 'status', 'date', sqlite_where=status.in_(LIFECYCLE_STATUSES), postgresql_where=status.in_(LIFECYCLE_STATUSES)),
+                      {'sqlite_autoincrement': True}) # id nigdy nie wraca po przeniesieniu wizyty do archiwum
+
+class AppointmentArchive(db.Model):
+    """Zimna kopia zakonczonych wizyt (zrealizowana/odrzucona) - te same id, Review.appointment_id dalej na nie wskazuje."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    date = db.Column(db.Date, nullable=False)
+    start_min = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20))
+    proposed_date = db.Column(db.Date, nullable=True)
+    proposed_time = db.Column(db.String(50), nullable=True)
+    client_id = db.Column(db.Integer)
+    employee_id = db.Column(db.Integer)
+    service_id = db.Column(db.Integer)
+    salon_id = db.Column(db.Integer)
+    archived_at = db.Column(db.Date, nullable=False)
+    time = minutes_as_hhmm('start_min')
+    archived = True # szablony: bez akcji na wizycie (ocena, anulowanie)
+    # Tylko do odczytu (historia klienta) - bez kluczy obcych, jak w tabeli archiwum
+    service = db.relationship('Service', primaryjoin='foreign(AppointmentArchive.service_id) == Service.id', viewonly=True)
+    employee = db.relationship('User', primaryjoin='foreign(AppointmentArchive.employee_id) == User.id', viewonly=True)
+    review_obj = db.relationship('Review', primaryjoin='foreign(Review.appointment_id) == AppointmentArchive.id', uselist=False, viewonly=True)
+    __table_args__ = (db.Index('ix_appointment_archive_salon_status', 'salon_id', 'status'),
+                      db.Index('ix_appointment_archive_employee_status', 'employee_id', 'status'),
+                      db.Index('ix_appointment_archive_client_date', 'client_id', 'date'))
 
 class WorkSchedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    date = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     is_working = db.Column(db.Boolean, default=True)
-    start_time = db.Column(db.String(5), nullable=True)
-    end_time = db.Column(db.String(5), nullable=True)
-    break_start = db.Column(db.String(5), nullable=True)
-    break_end = db.Column(db.String(5), nullable=True)
+    start_min = db.Column(db.Integer, nullable=True)
+    end_min = db.Column(db.Integer, nullable=True)
+    break_start_min = db.Column(db.Integer, nullable=True)
+    break_end_min = db.Column(db.Integer, nullable=True)
+    start_time, end_time = minutes_as_hhmm('start_min'), minutes_as_hhmm('end_min')
+    break_start, break_end = minutes_as_hhmm('break_start_min'), minutes_as_hhmm('break_end_min')
     __table_args__ = (db.UniqueConstraint('employee_id', 'date', name='_employee_date_uc'),)
 
+class DayCapacity(db.Model):
+    """Indeks pojemnosci dnia pracownika (wolne minuty, najdluzsza wolna luka) - liczony leniwie, kasowany przy zmianach wizyt, grafiku i godzin salonu."""
+    employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    salon_id = db.Column(db.Integer, nullable=False)
+    free_minutes = db.Column(db.Integer, nullable=False)
+    longest_gap = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.Float, nullable=False) # unix time - Last-Modified kalendarza
+    gaps = db.Column(db.Text, nullable=False) # JSON [[pierwszy start, koniec]] - dzisiaj luki przycina past_cutoff przy odczycie
+    __table_args__ = (db.Index('ix_day_capacity_date', 'date'),)
+
+# --- LICZNIKI OCEN (aktualizowane w tej samej transakcji co Review) ---
+def _add_rating(connection, employee_id, rating, sign):
+    connection.execute(update(User).where(User.id == employee_id).values(rating_sum=User.rating_sum + sign * rating, rating_count=User.rating_count + sign))
+    connection.execute(update(Salon).where(Salon.id == select(User.salon_id).where(User.id == employee_id).scalar_subquery()).values(rating_sum=Salon.rating_sum + sign * rating, rating_count=Salon.rating_count + sign))
+
+@event.listens_for(Review, 'after_insert')
+def _review_inserted(mapper, connection, target): _add_rating(connection, target.employee_id, target.rating, 1)
+
+@event.listens_for(Review, 'after_delete')
+def _review_deleted(mapper, connection, target): _add_rating(connection, target.employee_id, target.rating, -1)
+
+@event.listens_for(Review, 'after_update')
+def _review_updated(mapper, connection, target):
+    emp, rating = inspect(target).attrs.employee_id.history, inspect(target).attrs.rating.history
+    if emp.has_changes() or rating.has_changes():
+        _add_rating(connection, (emp.deleted or [target.employee_id])[0], (rating.deleted or [target.rating])[0], -1)
+        _add_rating(connection, target.employee_id, target.rating, 1)
+
+def rebuild_ratings():
+    """Przelicza liczniki ocen pracownikow i salonow od zera na podstawie tabeli Review."""
+    emp_revs = Review.query.filter(Review.employee_id == User.id)
+    db.session.execute(update(User).values(rating_sum=emp_revs.with_entities(func.coalesce(func.sum(Review.rating), 0)).scalar_subquery(), rating_count=emp_revs.with_entities(func.count(Review.id)).scalar_subquery()))
+    salon_revs = Review.query.join(User, Review.employee_id == User.id).filter(User.salon_id == Salon.id)
+    db.session.execute(update(Salon).values(rating_sum=salon_revs.with_entities(func.coalesce(func.sum(Review.rating), 0)).scalar_subquery(), rating_count=salon_revs.with_entities(func.count(Review.id)).scalar_subquery()))
+    db.session.commit()
+    bump_data_version() # UPDATE przez Core omija zdarzenia sesji
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -95,81 +230,608 @@ def calc_end_time_filter(start_time_str, duration_minutes):
     except:
         return "??"
 
-# --- FUNKCJA Z BLOKADĄ GODZIN Z PRZESZŁOŚCI ---
-def get_slots_for_day(date_str, salon, service, employee):
-    schedule = WorkSchedule.query.filter_by(employee_id=employee.id, date=date_str).first()
-    
-    emp_start, emp_end = None, None
-    break_start, break_end = None, None
-    is_working_day = False
-    
-    dt_obj = datetime.strptime(date_str, "%Y-%m-%d")
-    weekday = str(dt_obj.weekday())
+# --- STRONICOWANIE (keyset) ---
+def keyset_page(query, keys, cursor, size, desc=False):
+    """Strona `size` wierszy posortowanych po `keys` (ostatni klucz unikalny) za kursorem; zwraca (wiersze, kursor nastepnej strony albo None).
+    Kursor to wartosci kluczy ostatniego wiersza: WHERE (k1, k2, ...) > (...) idzie po indeksie, wiec koszt nie rosnie z numerem strony.
+    `desc` odwraca kolejnosc (i porownanie z kursorem)."""
+    if cursor: query = query.filter(tuple_(*keys) < tuple_(*cursor) if desc else tuple_(*keys) > tuple_(*cursor))
+    rows = query.order_by(*([k.desc() for k in keys] if desc else keys)).limit(size + 1).all()
+    if len(rows) <= size: return rows, None
+    rows = rows[:size]
+    return rows, ','.join(str(getattr(rows[-1], k.key)) for k in keys)
+
+def parse_cursor(raw, *types):
+    """Kursor 'v1,v2,...' z adresu -> lista wartosci; brak lub uszkodzony kursor -> None (pierwsza strona)."""
+    parts = (raw or '').split(',')
+    if not raw or len(parts) != len(types): return None
+    try: return [t(p) for t, p in zip(types, parts)]
+    except ValueError: return None
+
+def parse_day(value): return datetime.strptime(value, "%Y-%m-%d").date()
+
+@app.template_global()
+def page_url(**changes):
+    """Adres biezacej strony z podmienionymi parametrami (None usuwa parametr) - linki stronicowania zachowuja filtry."""
+    args = request.args.to_dict(); args.update(changes)
+    return url_for(request.endpoint, **{k: v for k, v in args.items() if v is not None})
+
+# --- CACHE (w procesie albo wspoldzielony przez workery) ---
+class MemoryCache:
+    """Cache w pamieci procesu: LRU z limitem wpisow i TTL w sekundach. Zwracanych wartosci nie wolno modyfikowac."""
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize, self.ttl, self.data, self.lock = maxsize, ttl, OrderedDict(), threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            hit = self.data.get(key)
+            if hit is None: return None
+            if hit[0] < time.monotonic(): del self.data[key]; return None
+            self.data.move_to_end(key); return hit[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value); self.data.move_to_end(key)
+            while len(self.data) > self.maxsize: self.data.popitem(last=False)
 
+    def delete(self, key):
+        with self.lock: self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock: self.data.clear()
+
+class SqliteCache:
+    """Cache w lokalnym pliku SQLite, wspolny dla wielu procesow (np. workerow Gunicorna); wartosci zapisywane jako JSON.
+    Limit wpisow usuwa najdawniej zapisane (przyblizenie LRU bez zapisu przy kazdym odczycie)."""
+    def __init__(self, path, maxsize=1024, ttl=300):
+        self.path, self.maxsize, self.ttl, self.local = path, maxsize, ttl, threading.local()
+        with self._conn() as conn: conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+
+    def _conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.path, timeout=5)
+            self.local.conn.execute('PRAGMA journal_mode=WAL')
+        return self.local.conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value FROM cache WHERE key = ? AND expires >= ?', (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', (key, json.dumps(value), time.time() + self.ttl))
+            conn.execute('DELETE FROM cache WHERE expires < ? OR key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)', (time.time(), self.maxsize))
+
+    def delete(self, key):
+        with self._conn() as conn: conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._conn() as conn: conn.execute('DELETE FROM cache')
+
+def make_cache(backend, maxsize, ttl):
+    """'memory' -> MemoryCache, 'sqlite:///sciezka.db' -> SqliteCache (sciezka wzgledna liczona od katalogu instance)."""
+    if backend == 'memory': return MemoryCache(maxsize, ttl)
+    if backend.startswith('sqlite:///'): return SqliteCache(os.path.join(app.instance_path, backend[len('sqlite:///'):]), maxsize, ttl)
+    raise ValueError(f'Nieznany backend cache: {backend}')
+
+# --- GRAFIKI PRACOWNIKOW (skompilowane, w cache) ---
+schedule_cache = make_cache(app.config['SCHEDULE_CACHE'], app.config['SCHEDULE_CACHE_SIZE'], app.config['SCHEDULE_CACHE_TTL'])
+
+def weekly_template(employee):
+    """Domyslny tydzien pracownika: (dni robocze jako '0'..'6', przerwy z breaks_json)."""
+    days = set(employee.work_days.split(',')) if employee.work_days else set()
+    try: breaks = json.loads(employee.breaks_json) if employee.breaks_json else {}
+    except ValueError: breaks = {}
+    return days, (breaks if isinstance(breaks, dict) else {})
+
+def compile_schedule(employee, overrides):
+    """Wpis cache grafiku: dni robocze, przerwy (w minutach i jako tekst z formularza) i mapa data -> nadpisanie z WorkSchedule."""
+    days, raw = weekly_template(employee); breaks, texts = {}, {}
+    for wd, b in raw.items():
+        if not isinstance(b, dict): continue
+        texts[wd] = [b.get('start', ''), b.get('end', '')]
+        try:
+            if b.get('start') and b.get('end'): breaks[wd] = [to_min(b['start']), to_min(b['end'])]
+        except (ValueError, TypeError, AttributeError): pass
+    return {'days': sorted(days), 'breaks': breaks, 'break_texts': texts, 'overrides': {s.date.isoformat(): [s.is_working, s.start_min, s.end_min, s.break_start_min, s.break_end_min] for s in overrides}}
+
+def load_schedules(employees):
+    """Grafiki {id pracownika: wpis} skompilowane prosto z bazy (jedno zapytanie o WorkSchedule), z pominieciem cache."""
+    rows = defaultdict(list)
+    for s in WorkSchedule.query.filter(WorkSchedule.employee_id.in_([m.id for m in employees])): rows[s.employee_id].append(s)
+    return {m.id: compile_schedule(m, rows[m.id]) for m in employees}
+
+def schedules_for(employees):
+    """Skompilowane grafiki {id pracownika: wpis}; brakujace w cache ladowane przez load_schedules."""
+    out = {m.id: schedule_cache.get(f'schedule:{m.id}') for m in employees}
+    missing = [m for m in employees if out[m.id] is None]
+    if missing:
+        for emp_id, sched in load_schedules(missing).items():
+            out[emp_id] = sched; schedule_cache.set(f'schedule:{emp_id}', sched)
+    return out
+
+def invalidate_schedules(employee_ids):
+    for emp_id in employee_ids: schedule_cache.delete(f'schedule:{emp_id}')
+
+# Zmiany User/WorkSchedule zbierane przy flushu, cache czyszczony dopiero po udanym commicie
+@event.listens_for(db.session, 'after_flush')
+def _collect_schedule_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User): session.info.setdefault('schedule_dirty', set()).add(obj.id)
+        elif isinstance(obj, WorkSchedule):
+            session.info.setdefault('schedule_dirty', set()).update([obj.employee_id] + list(inspect(obj).attrs.employee_id.history.deleted))
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_schedule_cache(session): invalidate_schedules(session.info.pop('schedule_dirty', ()))
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_schedule_changes(session): session.info.pop('schedule_dirty', None)
+
+# --- SILNIK DOSTEPNOSCI (przedzialy w minutach) ---
+SLOT_STEP = 5
+
+def to_min(hhmm):
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+def fmt_min(m): return f"{m // 60:02d}:{m % 60:02d}"
+
+def fmt_opt(m, empty=None): return empty if m is None else fmt_min(m)
+
+def day_window(d, salon, sched):
+    """Okno pracy (start, koniec, przerwa) w minutach albo None, gdy pracownik nie pracuje; `sched` ze schedules_for()."""
     # 1. Priorytet: Grafik Dzienny Pracownika
-    if schedule:
-        if not schedule.is_working: return []
-        is_working_day = True
-        emp_start = datetime.strptime(schedule.start_time, "%H:%M")
-        emp_end = datetime.strptime(schedule.end_time, "%H:%M")
-        if schedule.break_start and schedule.break_end:
-            break_start = datetime.strptime(schedule.break_start, "%H:%M")
-            break_end = datetime.strptime(schedule.break_end, "%H:%M")
-    
+    override = sched['overrides'].get(d.isoformat())
+    if override:
+        is_working, start, end, bs, be = override
+        if not is_working or start is None or end is None: return None # wpis bez godzin (stare dane) = brak okna pracy
+        brk = (bs, be) if bs is not None and be is not None else None
     # 2. Domyślnie: Godziny Salonu
     else:
-        work_days = employee.work_days.split(',') if employee.work_days else []
-        if weekday in work_days:
-            is_working_day = True
-            emp_start = datetime.strptime(salon.open_from, "%H:%M")
-            emp_end = datetime.strptime(salon.open_to, "%H:%M")
-            if employee.breaks_json:
-                try:
-                    breaks = json.loads(employee.breaks_json)
-                    day_break = breaks.get(weekday)
-                    if day_break and day_break.get('start') and day_break.get('end'):
-                        break_start = datetime.strptime(day_break['start'], "%H:%M")
-                        break_end = datetime.strptime(day_break['end'], "%H:%M")
-                except: pass
-        else: return []
-
-    if not is_working_day: return []
-    if emp_start >= emp_end: return [] # Zabezpieczenie
-
-    existing = Appointment.query.filter(Appointment.employee_id == employee.id, Appointment.date == date_str, Appointment.status != 'odrzucona').all()
-    slots = []
-    curr = emp_start
-    dur = timedelta(minutes=service.duration)
-    
-    now = datetime.now()
-    is_today = (date_str == now.strftime("%Y-%m-%d"))
-
-    while curr + dur <= emp_end:
-        free = True
-        ns, ne = curr, curr + dur
-        
-        # 1. Sprawdź czy godzina nie minęła (tylko jeśli to dzisiaj)
-        if is_today and ns.time() <= now.time():
-            free = False
-
-        # 2. Sprawdź przerwę
-        if free and break_start and break_end:
-            if max(ns, break_start) < min(ne, break_end): free = False
-        
-        # 3. Sprawdź inne wizyty
-        if free:
-            for ex in existing:
-                if ex.service:
-                    es = datetime.strptime(ex.time, "%H:%M")
-                    ee = es + timedelta(minutes=ex.service.duration)
-                    if ns < ee and ne > es:
-                        free = False; break
-        
-        if free: slots.append(curr.strftime("%H:%M"))
-        curr += timedelta(minutes=5)
-    
+        wd = str(d.weekday())
+        if wd not in sched['days']: return None
+        start, end = to_min(salon.open_from), to_min(salon.open_to)
+        brk = tuple(sched['breaks'][wd]) if wd in sched['breaks'] else None
+    if start >= end: return None # Zabezpieczenie
+    return start, end, brk
+
+def free_gaps(window, busy, with_break=True):
+    """Wolne luki [(od, do)] w oknie pracy; bloki scalane tylko gdy na siebie nachodza (stykajace sie zostawiaja luke zerowej dlugosci)."""
+    start, end, brk = window
+    # Przerwa blokuje tylko przy dodatnim przecieciu (max(start) < min(koniec)), jak dotychczas
+    blocks = sorted(busy + [brk] if with_break and brk and brk[0] < brk[1] else busy)
+    gaps, cur = [], start
+    for bs, be in blocks:
+        if bs >= cur: gaps.append((cur, min(bs, end)))
+        cur = max(cur, be)
+    gaps.append((cur, end))
+    return gaps
+
+def free_slots(window, busy, duration, min_start=None):
+    """Godziny rozpoczecia (w minutach, co SLOT_STEP od poczatku zmiany), w ktorych usluga miesci sie w wolnej luce."""
+    start, slots = window[0], []
+    for g0, g1 in free_gaps(window, busy, duration > 0):
+        first = g0 if min_start is None else max(g0, min_start)
+        s = start + -(-(first - start) // SLOT_STEP) * SLOT_STEP
+        while s + duration <= g1:
+            if not slots or s > slots[-1]: slots.append(s)
+            s += SLOT_STEP
     return slots
 
+def date_range(d_from, d_to):
+    d = d_from
+    while d <= d_to: yield d; d += timedelta(days=1)
+
+def past_cutoff(day, now):
+    """Najwczesniejsza minuta startu dla danego dnia - dzisiaj odpadaja godziny, ktore juz minely."""
+    return now.hour * 60 + now.minute + 1 if day == now.date() else None
+
+def load_busy(employee_ids, d_from, d_to):
+    """Zajete bloki {(pracownik, data): [(start, koniec)]} w minutach dla calego okna dat - jedno zapytanie."""
+    busy = defaultdict(list)
+    rows = db.session.query(Appointment.employee_id, Appointment.date, Appointment.start_min, Service.duration).join(Service, Appointment.service_id == Service.id).filter(Appointment.employee_id.in_(employee_ids), Appointment.date.between(d_from, d_to), Appointment.status != 'odrzucona')
+    for emp_id, d, t, dur in rows: busy[(emp_id, d)].append((t, t + dur))
+    return busy
+
+def get_availability(salon, service, employee, d_from, d_to):
+    """Wolne godziny {data: [HH:MM]} dla kazdego dnia z zakresu <d_from, d_to>."""
+    sched, busy = schedules_for([employee])[employee.id], load_busy([employee.id], d_from, d_to)
+    now = datetime.now(); out = {}
+    for d in date_range(d_from, d_to):
+        key = (employee.id, d)
+        window = day_window(d, salon, sched)
+        out[d.isoformat()] = [fmt_min(m) for m in free_slots(window, busy[key], service.duration, past_cutoff(d, now))] if window else []
+    return out
+
+def first_free_date(availability): return next((d for d, slots in availability.items() if slots), None)
+
+def earliest_slots(salon, service, d_from, days, limit):
+    """Najwczesniejsze wolne terminy [(data, HH:MM, pracownik)] u calej obsady salonu.
+
+    Grafiki (z cache) i wizyty wszystkich pracownikow laduja sie hurtowo, a leniwe strumienie
+    terminow kazdego pracownika sa scalane kopcem - liczymy tylko tyle dni, ile potrzeba do `limit`."""
+    staff = User.query.filter(User.salon_id == salon.id, User.role.in_(['pracownik', 'szef'])).all()
+    if not staff: return []
+    now = datetime.now(); d_from = max(d_from, now.date()) # dni przeszle nigdy nie maja wolnych terminow
+    d_to = d_from + timedelta(days=days - 1); ids = [m.id for m in staff]
+    scheds, busy = schedules_for(staff), load_busy(ids, d_from, d_to)
+
+    def stream(m):
+        for d in date_range(d_from, d_to):
+            key = (m.id, d)
+            window = day_window(d, salon, scheds[m.id])
+            if window:
+                for t in free_slots(window, busy.get(key, []), service.duration, past_cutoff(d, now)): yield d, t, m.id
+
+    by_id = {m.id: m for m in staff}
+    return [(d.isoformat(), fmt_min(t), by_id[e]) for d, t, e in islice(heapq.merge(*(stream(m) for m in staff)), limit)]
+
+# --- FUNKCJA Z BLOKADĄ GODZIN Z PRZESZŁOŚCI ---
+def get_slots_for_day(date_str, salon, service, employee):
+    d = datetime.strptime(date_str, "%Y-%m-%d").date()
+    return get_availability(salon, service, employee, d, d)[d.isoformat()]
+
+# --- REZERWACJA (sprawdzenie i zapis w jednej krotkiej transakcji) ---
+BOOKING_LOCKS = [threading.Lock() for _ in range(64)] # blokady w procesie, paskowane po (pracownik, dzien)
+
+def booking_lock(employee_id, d): return BOOKING_LOCKS[hash((employee_id, d)) % len(BOOKING_LOCKS)]
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    if not isinstance(dbapi_conn, sqlite3.Connection): return
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL'); cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cur.close()
+
+def reserve_slot(d, time_str, salon, service, employee, client):
+    """Rezerwuje termin, jesli nadal jest wolny; zwraca (wizyta, None) albo (None, wolne godziny tego dnia).
+    Watki jednego procesu czekaja na blokadzie (pracownik, dzien), procesy - na BEGIN IMMEDIATE (SQLite) lub FOR UPDATE na pracowniku."""
+    ids = (salon.id, service.id, employee.id, client.id)
+    db.session.commit() # oddaje polaczenie do puli - czekajacy na blokade nie trzymaja polaczen
+    with booking_lock(ids[2], d):
+        try:
+            if db.engine.dialect.name == 'sqlite': db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            else: db.session.execute(select(User.id).where(User.id == ids[2]).with_for_update())
+            salon, service, employee = db.session.get(Salon, ids[0]), db.session.get(Service, ids[1]), db.session.get(User, ids[2])
+            slots = get_availability(salon, service, employee, d, d)[d.isoformat()]
+            if time_str not in slots: db.session.rollback(); return None, slots
+            a = Appointment(date=d, time=time_str, client_id=ids[3], employee_id=employee.id, service_id=service.id, salon_id=salon.id)
+            db.session.add(a); db.session.commit()
+            return a, None
+        except Exception:
+            db.session.rollback(); raise
+
+def nearest_slots(slots, time_str, n):
+    """n wolnych godzin najblizszych wybranej, w kolejnosci chronologicznej."""
+    try: want = to_min(time_str)
+    except (ValueError, TypeError, AttributeError): return slots[:n]
+    return sorted(sorted(slots, key=lambda t: abs(to_min(t) - want))[:n])
+
+# --- INDEKS POJEMNOSCI DNI (DayCapacity) ---
+def _drop_capacity(connection, *where): connection.execute(delete(DayCapacity).where(*where))
+
+def _drop_day_capacity(connection, target, watched=None):
+    """Kasuje dni (pracownik, data) wizyty lub wpisu grafiku - stare i nowe wartosci; z `watched` tylko gdy zmienila sie ktoras z tych kolumn."""
+    attrs = inspect(target).attrs
+    if watched and not any(attrs[c].history.has_changes() for c in watched): return
+    _drop_capacity(connection, DayCapacity.employee_id.in_({target.employee_id, *attrs.employee_id.history.deleted}), DayCapacity.date.in_({target.date, *attrs.date.history.deleted}))
+
+# Kasowanie w tej samej transakcji co zmiana (jak liczniki ocen); brakujace wiersze liczy capacity_for przy odczycie
+@event.listens_for(Appointment, 'after_insert')
+@event.listens_for(Appointment, 'after_delete')
+@event.listens_for(WorkSchedule, 'after_insert')
+@event.listens_for(WorkSchedule, 'after_delete')
+def _capacity_day_changed(mapper, connection, target): _drop_day_capacity(connection, target)
+
+@event.listens_for(Appointment, 'after_update')
+def _capacity_appointment_updated(mapper, connection, target): _drop_day_capacity(connection, target, ['status', 'date', 'start_min', 'employee_id', 'service_id'])
+
+@event.listens_for(WorkSchedule, 'after_update')
+def _capacity_schedule_updated(mapper, connection, target): _drop_day_capacity(connection, target, ['is_working', 'date', 'employee_id', 'start_min', 'end_min', 'break_start_min', 'break_end_min'])
+
+@event.listens_for(User, 'after_update')
+def _capacity_employee_updated(mapper, connection, target):
+    if any(inspect(target).attrs[c].history.has_changes() for c in ('work_days', 'breaks_json', 'salon_id', 'role')): _drop_capacity(connection, DayCapacity.employee_id == target.id)
+
+@event.listens_for(User, 'after_delete')
+def _capacity_employee_deleted(mapper, connection, target): _drop_capacity(connection, DayCapacity.employee_id == target.id)
+
+@event.listens_for(Salon, 'after_update')
+def _capacity_salon_updated(mapper, connection, target):
+    if any(inspect(target).attrs[c].history.has_changes() for c in ('open_from', 'open_to')): _drop_capacity(connection, DayCapacity.salon_id == target.id)
+
+# Czas trwania uslugi wyznacza zajete bloki jej wizyt
+@event.listens_for(Service, 'after_update')
+def _capacity_service_updated(mapper, connection, target):
+    if inspect(target).attrs.duration.history.has_changes(): _drop_capacity(connection, DayCapacity.salon_id == target.salon_id)
+
+@event.listens_for(Service, 'after_delete')
+def _capacity_service_deleted(mapper, connection, target): _drop_capacity(connection, DayCapacity.salon_id == target.salon_id)
+
+def slot_gaps(window, busy):
+    """Niepuste wolne luki [(pierwsza godzina startu na siatce SLOT_STEP, koniec)] dnia pracownika, jak w free_slots."""
+    if not window: return []
+    start, gaps = window[0], []
+    for g0, g1 in free_gaps(window, busy):
+        first = start + -(-(g0 - start) // SLOT_STEP) * SLOT_STEP
+        if first < g1: gaps.append((first, g1))
+    return gaps
+
+def day_capacity(gaps, min_start=None):
+    """(wolne minuty, najdluzsza luka) z luk slot_gaps; z `min_start` luka zaczyna sie od pierwszej godziny startu nie wczesniej
+    (pierwszy start lezy na siatce, wiec siatka sie nie zmienia) - luka >= czas uslugi oznacza, ze jest na nia termin."""
+    lengths = [max(0, g1 - (first if min_start is None or min_start <= first else first + -(-(min_start - first) // SLOT_STEP) * SLOT_STEP)) for first, g1 in gaps]
+    return sum(lengths), max(lengths, default=0)
+
+def capacity_rows(staff, scheds, d_from, d_to):
+    """Wiersze DayCapacity (dict) pracownikow dla kazdego dnia zakresu - caly dzien pracy, bez past_cutoff."""
+    busy = load_busy([m.id for m in staff], d_from, d_to)
+    salons = {s.id: s for s in Salon.query.filter(Salon.id.in_({m.salon_id for m in staff}))}
+    rows, stamp = [], time.time()
+    for m in staff:
+        for d in date_range(d_from, d_to):
+            window = day_window(d, salons[m.salon_id], scheds[m.id]) if m.salon_id in salons else None
+            gaps = slot_gaps(window, busy.get((m.id, d), []))
+            free, gap = day_capacity(gaps)
+            rows.append({'employee_id': m.id, 'date': d, 'salon_id': m.salon_id, 'free_minutes': free, 'longest_gap': gap, 'computed_at': stamp, 'gaps': json.dumps(gaps)})
+    return rows
+
+def fill_capacity(employee_ids, d_from, d_to):
+    """Liczy i zapisuje DayCapacity pracownikow dla kazdego dnia zakresu; zwraca wiersze jako dict.
+    Odczyt wizyt i zapis w jednej transakcji zapisu (BEGIN IMMEDIATE na SQLite) - rownolegla rezerwacja nie zostawi nieaktualnego wiersza.
+    Grafiki z bazy, nie z schedule_cache: wiersze nie maja TTL, a cache 'memory' innego workera (albo przed after_commit) bywa nieaktualny."""
+    db.session.commit() # jak w reserve_slot: nowa transakcja od razu z blokada zapisu
+    try:
+        if db.engine.dialect.name == 'sqlite': db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+        staff = User.query.filter(User.id.in_(employee_ids)).all()
+        rows = capacity_rows(staff, load_schedules(staff), d_from, d_to)
+        upsert = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+        it = iter(rows)
+        while chunk := list(islice(it, 500)): db.session.execute(upsert(DayCapacity).values(chunk).on_conflict_do_nothing())
+        db.session.commit()
+        return rows
+    except Exception:
+        db.session.rollback(); raise
+
+def capacity_for(d_from, d_to):
+    """Wiersze DayCapacity calej obsady w zakresie dat - jeden odczyt po ix_day_capacity_date; brakujacych pracownikow liczy fill_capacity.
+    Wiersze licza caly dzien pracy - minione godziny dzisiaj odcina day_states z kolumny gaps."""
+    staff = {uid: salon_id for uid, salon_id in db.session.query(User.id, User.salon_id).filter(User.salon_id.isnot(None), User.role.in_(['pracownik', 'szef']))}
+    rows = [r for r in db.session.query(DayCapacity.employee_id, DayCapacity.date, DayCapacity.salon_id, DayCapacity.free_minutes, DayCapacity.longest_gap, DayCapacity.computed_at, DayCapacity.gaps).filter(DayCapacity.date.between(d_from, d_to)) if r[0] in staff]
+    have = defaultdict(int)
+    for r in rows: have[r[0]] += 1
+    missing = [uid for uid in staff if have[uid] < (d_to - d_from).days + 1]
+    if missing:
+        rows = [r for r in rows if r[0] not in missing]
+        rows += [tuple(r.values()) for r in fill_capacity(missing, d_from, d_to)]
+    return rows
+
+def day_states(d_from, d_to):
+    """({data ISO: 'full' | 'few'}, czas ostatniej zmiany): 'full' - nikt z obsady nie ma luki na najkrotsza usluge swojego salonu,
+    'few' - suma wolnych minut tych, u ktorych cos sie miesci, ponizej CAPACITY_FEW_MIN. Pozostale dni nie wystepuja."""
+    min_duration = dict(page_fragment('min_duration', (), lambda: [list(r) for r in db.session.query(Service.salon_id, func.min(Service.duration)).group_by(Service.salon_id)]))
+    free, changed, now = defaultdict(lambda: None), data_version()[1], datetime.now()
+    rows = capacity_for(max(d_from, now.date()), d_to) if d_to >= now.date() else []
+    for emp_id, d, salon_id, free_minutes, longest_gap, computed_at, gaps in rows:
+        changed = max(changed, computed_at)
+        if d == now.date(): free_minutes, longest_gap = day_capacity(json.loads(gaps), past_cutoff(d, now))
+        if salon_id in min_duration and longest_gap >= min_duration[salon_id]: free[d] = (free[d] or 0) + free_minutes
+    states = {}
+    for d in date_range(d_from, d_to):
+        if free[d] is None: states[d.isoformat()] = 'full'
+        elif free[d] < app.config['CAPACITY_FEW_MIN']: states[d.isoformat()] = 'few'
+    return states, changed
+
+# --- CACHE STRON REZERWACJI (fragmenty, ETag / Last-Modified) ---
+page_cache = make_cache(app.config['PAGE_CACHE'], app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+
+def bump_data_version():
+    v = [os.urandom(6).hex(), time.time()]; page_cache.set('data_version', v); return v
+
+def data_version():
+    """[znacznik, unix time] ostatniej zmiany Salon/Service/Review - czesc kluczy fragmentow i ETagow."""
+    return page_cache.get('data_version') or bump_data_version()
+
+def page_fragment(name, args, build):
+    """Fragment strony z page_cache (wartosc musi przejsc przez JSON); klucz: nazwa, argumenty i wersja danych."""
+    key = ':'.join(['page', name, data_version()[0], *map(str, args)])
+    hit = page_cache.get(key)
+    if hit is None: hit = build(); page_cache.set(key, hit)
+    return hit
+
+def conditional_page(etag_parts, changed, render):
+    """Odpowiedz z ETag (czesci + uzytkownik - pasek nawigacji jest per uzytkownik) i Last-Modified; 304 bez renderowania, gdy kopia klienta jest aktualna.
+    Przy czekajacym komunikacie flash zwykla odpowiedz bez walidatorow - strona z komunikatem nie moze wracac z cache przegladarki."""
+    if '_flashes' in session:
+        resp = make_response(render()); resp.cache_control.no_store = True; return resp
+    etag = hashlib.sha1(repr((current_user.get_id(), *etag_parts)).encode()).hexdigest()[:24]
+    modified = datetime.fromtimestamp(int(changed), timezone.utc)
+    resp = make_response(render()) if is_resource_modified(request.environ, etag=etag, last_modified=modified) else app.response_class(status=304)
+    resp.set_etag(etag); resp.last_modified = modified; resp.cache_control.private = True; resp.cache_control.no_cache = True
+    return resp
+
+# Zapisy Salon/Service/Review zbierane przy flushu, wersja danych zmieniana dopiero po udanym commicie
+@event.listens_for(db.session, 'after_flush')
+def _collect_page_changes(session, flush_context):
+    if any(isinstance(obj, (Salon, Service, Review)) for obj in list(session.new) + list(session.dirty) + list(session.deleted)): session.info['pages_dirty'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_page_version(session):
+    if session.info.pop('pages_dirty', False): bump_data_version()
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_page_changes(session): session.info.pop('pages_dirty', None)
+
+# --- RAPORTY (agregaty liczone w SQL) ---
+ARCHIVE_COLUMNS = ['id', 'date', 'start_min', 'status', 'proposed_date', 'proposed_time', 'client_id', 'employee_id', 'service_id', 'salon_id']
+
+def all_appointments(where):
+    """Wizyty biezace i archiwalne (UNION ALL) jako podzapytanie; `where(model)` daje warunki wstawiane do obu galezi, zeby kazda szla po swoim indeksie."""
+    branches = [select(*(getattr(m, c) for c in ARCHIVE_COLUMNS)).where(*where(m)) for m in (Appointment, AppointmentArchive)]
+    return union_all(*branches).subquery('all_appointments')
+
+def margin_cut(salon):
+    """Prowizja salonu od wizyty (Salon.margin_type / margin_value) jako wyrazenie SQL."""
+    mv = salon.margin_value or 0.0
+    return Service.price * (mv / 100.0) if salon.margin_type == 'percent' else literal(mv)
+
+def margin_net(salon):
+    """Kwota do wyplaty dla pracownika: cena minus prowizja, nie mniej niz 0."""
+    net = Service.price - margin_cut(salon)
+    return case((net > 0, net), else_=0.0)
+
+def salon_report(salon):
+    """Dane panelu szefa: zysk salonu i raport pracownikow - kilka zapytan GROUP BY zamiast petli per pracownik (oceny z licznikow)."""
+    staff = User.query.filter(User.salon_id == salon.id, User.role.in_(['pracownik', 'szef'])).all(); ids = [m.id for m in staff]
+    done = all_appointments(lambda m: (m.salon_id == salon.id, m.status == 'zrealizowana'))
+    done_by_staff = all_appointments(lambda m: (m.employee_id.in_(ids), m.status == 'zrealizowana'))
+
+    net = db.session.query(func.coalesce(func.sum(margin_cut(salon)), 0)).select_from(done).join(Service, done.c.service_id == Service.id).scalar()
+    money = {e: (g, n) for e, g, n in db.session.query(done_by_staff.c.employee_id, func.sum(Service.price), func.sum(margin_net(salon))).select_from(done_by_staff).join(Service, done_by_staff.c.service_id == Service.id).group_by(done_by_staff.c.employee_id)}
+    upcoming = defaultdict(list)
+    for a in Appointment.query.options(joinedload(Appointment.service), joinedload(Appointment.client)).filter(Appointment.employee_id.in_(ids), Appointment.status == 'potwierdzona', Appointment.date >= datetime.now().date()).order_by(Appointment.date):
+        upcoming[a.employee_id].append(a)
+
+    staff_report = []
+    for m in staff:
+        gross, m_net = money.get(m.id, (0, 0.0))
+        staff_report.append({'username': m.username, 'role': m.role, 'gross': gross, 'net': round(m_net, 2), 'upcoming': upcoming[m.id], 'upcoming_count': len(upcoming[m.id]), 'avg_rating': m.avg_rating, 'reviews_count': m.rating_count})
+    return {'salon_net_profit': round(net, 2), 'staff_report': staff_report, 'total_reviews_count': salon.rating_count, 'salon_avg_rating': salon.avg_rating}
+
+# --- EKSPORT (strumieniowo, stala pamiec) ---
+EXPORT_COLUMNS = ['id', 'data', 'godzina', 'status', 'usluga', 'czas_min', 'cena', 'prowizja_salonu', 'netto_pracownika', 'pracownik', 'klient']
+
+def export_rows(salon, d_from, d_to, status=None):
+    """Wiersze eksportu (krotki w kolejnosci EXPORT_COLUMNS) czytane partiami po EXPORT_BATCH na osobnym polaczeniu - nie trzyma calego wyniku w pamieci."""
+    emp, client = aliased(User), aliased(User)
+    a = all_appointments(lambda m: (m.salon_id == salon.id, m.date.between(d_from, d_to)) + ((m.status == status,) if status else ()))
+    stmt = select(a.c.id, a.c.date, a.c.start_min, a.c.status, Service.name, Service.duration, Service.price,
+                  func.round(margin_cut(salon), 2), func.round(margin_net(salon), 2), emp.username, client.username) \
+        .join(Service, a.c.service_id == Service.id).outerjoin(emp, a.c.employee_id == emp.id).outerjoin(client, a.c.client_id == client.id) \
+        .order_by(a.c.date, a.c.start_min, a.c.id)
+    with db.engine.connect() as conn:
+        for part in conn.execution_options(yield_per=app.config['EXPORT_BATCH']).execute(stmt).partitions():
+            for r in part: yield (r[0], r[1].isoformat(), fmt_min(r[2])) + tuple(r[3:])
+
+def export_csv(rows):
+    buf = io.StringIO(); out = csv.writer(buf)
+    out.writerow(EXPORT_COLUMNS); yield buf.getvalue()
+    for batch in iter(lambda: list(islice(rows, app.config['EXPORT_BATCH'])), []):
+        buf.seek(0); buf.truncate(); out.writerows(batch); yield buf.getvalue()
+
+def export_json(rows):
+    yield '['
+    for i, r in enumerate(rows): yield (',\n' if i else '\n') + json.dumps(dict(zip(EXPORT_COLUMNS, r)), ensure_ascii=False)
+    yield '\n]\n'
+
+# --- CYKL ZYCIA WIZYT (wygasanie prosb, zamykanie odbytych wizyt) ---
+def lifecycle_rules(now):
+    """[(nazwa, statusy zrodlowe, nowy status, warunek SQL)]; 'po czasie' liczone od poczatku lub konca wizyty plus LIFECYCLE_*_GRACE_MIN."""
+    def passed(grace, minute):
+        cut = now - timedelta(minutes=grace); cut_day, cut_min = cut.date(), cut.hour * 60 + cut.minute
+        return (Appointment.date < cut_day) | ((Appointment.date == cut_day) & (minute <= cut_min))
+    expired = passed(app.config['LIFECYCLE_EXPIRE_GRACE_MIN'], Appointment.start_min)
+    return [('wygasle prosby', ['oczekuje'], 'odrzucona', expired),
+            ('wygasle propozycje', ['zmiana_terminu'], 'odrzucona', expired & (Appointment.proposed_date.is_(None) | (Appointment.proposed_date < now.date()))),
+            ('zrealizowane', ['potwierdzona'], 'zrealizowana', passed(app.config['LIFECYCLE_COMPLETE_GRACE_MIN'], Appointment.start_min + Service.duration))]
+
+def run_lifecycle(now=None, batch=None):
+    """Jeden przebieg regul: UPDATE partiami po LIFECYCLE_BATCH, kazda partia w osobnej krotkiej transakcji; zwraca {regula: liczba wizyt}.
+    UPDATE sprawdza status jeszcze raz, wiec klikniecie pracownika miedzy SELECT a UPDATE wygrywa - mozna to puszczac obok workerow WWW."""
+    now, batch, done = now or datetime.now(), batch or app.config['LIFECYCLE_BATCH'], {}
+    for name, src, dst, cond in lifecycle_rules(now):
+        done[name] = 0
+        while True:
+            with db.engine.begin() as conn:
+                found = conn.execute(select(Appointment.id, Appointment.employee_id, Appointment.date).outerjoin(Service, Appointment.service_id == Service.id).where(Appointment.status.in_(LIFECYCLE_STATUSES), Appointment.status.in_(src), cond).limit(batch)).all()
+                ids = [r.id for r in found]
+                if ids: done[name] += conn.execute(update(Appointment).where(Appointment.id.in_(ids), Appointment.status.in_(src)).values(status=dst)).rowcount
+                if ids and dst == 'odrzucona': _drop_capacity(conn, tuple_(DayCapacity.employee_id, DayCapacity.date).in_({(r.employee_id, r.date) for r in found})) # odrzucona zwalnia czas
+            if len(ids) < batch: break
+    return done
+
+def start_lifecycle_scheduler(interval):
+    """Watek w tle (demon) wywolujacy run_lifecycle co `interval` sekund; kilka procesow z watkiem nie szkodzi, tylko dubluje prace."""
+    def loop():
+        while True:
+            try:
+                with app.app_context(): run_lifecycle()
+            except Exception: app.logger.exception('Blad przebiegu cyklu zycia wizyt')
+            time.sleep(interval)
+    threading.Thread(target=loop, name='lifecycle', daemon=True).start()
+
+if app.config['LIFECYCLE_INTERVAL_S'] > 0: start_lifecycle_scheduler(app.config['LIFECYCLE_INTERVAL_S'])
+
+# --- PROFILOWANIE (opcjonalne: PROFILING=1) ---
+class Metrics:
+    """Histogramy per endpoint (czas zadania, liczba i czas zapytan SQL) w formacie tekstowym Prometheusa."""
+    SERIES = {'salon_request_duration_seconds': ('Czas obslugi zadania', (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)),
+              'salon_request_sql_queries': ('Liczba zapytan SQL na zadanie', (1, 2, 5, 10, 20, 50, 100, 200, 500)),
+              'salon_request_sql_seconds': ('Laczny czas zapytan SQL na zadanie', (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))}
+
+    def __init__(self):
+        self.lock, self.hist, self.slow = threading.Lock(), {}, defaultdict(int)
+
+    def observe(self, endpoint, **values):
+        with self.lock:
+            for name, value in values.items():
+                buckets = self.SERIES[name][1]
+                h = self.hist.setdefault((name, endpoint), [[0] * (len(buckets) + 1), 0.0])
+                h[0][bisect_left(buckets, value)] += 1; h[1] += value
+
+    def slow_query(self, endpoint):
+        with self.lock: self.slow[endpoint] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in self.SERIES.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (series, endpoint), (counts, total) in sorted(self.hist.items()):
+                    if series != name: continue
+                    acc = 0
+                    for le, n in zip([str(b) for b in buckets] + ['+Inf'], counts):
+                        acc += n; lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{le}"}} {acc}')
+                    lines += [f'{name}_sum{{endpoint="{endpoint}"}} {total}', f'{name}_count{{endpoint="{endpoint}"}} {acc}']
+            lines += ['# HELP salon_slow_queries_total Zapytania wolniejsze niz SLOW_QUERY_MS', '# TYPE salon_slow_queries_total counter']
+            lines += [f'salon_slow_queries_total{{endpoint="{e}"}} {n}' for e, n in sorted(self.slow.items())]
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+sql_log = logging.getLogger('app.sql')
+
+def _query_started(conn, cursor, statement, parameters, context, executemany): conn.info['query_t0'] = time.perf_counter()
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    ms = (time.perf_counter() - conn.info['query_t0']) * 1000
+    endpoint = (request.endpoint or 'brak') if has_request_context() else 'cli'
+    if has_request_context() and 'prof_sql' in g: g.prof_sql[0] += 1; g.prof_sql[1] += ms
+    if ms >= app.config['SLOW_QUERY_MS']:
+        metrics.slow_query(endpoint); sql_log.warning('Wolne zapytanie %.1f ms [%s]: %s | %r', ms, endpoint, ' '.join(statement.split()), parameters)
+
+def _request_started(): g.prof_t0, g.prof_sql = time.perf_counter(), [0, 0.0]
+
+def _request_finished(exc):
+    if 'prof_t0' not in g: return
+    metrics.observe(request.endpoint or 'brak', salon_request_duration_seconds=time.perf_counter() - g.prof_t0,
+                    salon_request_sql_queries=g.prof_sql[0], salon_request_sql_seconds=g.prof_sql[1] / 1000)
+
+def enable_profiling():
+    """Podpina zdarzenia silnika i hooki zadan; bez wywolania aplikacja nie ma zadnego narzutu pomiarowego."""
+    event.listen(Engine, 'before_cursor_execute', _query_started)
+    event.listen(Engine, 'after_cursor_execute', _query_finished)
+    app.before_request(_request_started); app.teardown_request(_request_finished)
+
+if app.config['PROFILING']: enable_profiling()
+
+@app.route('/metrics')
+@login_required
+def metrics_endpoint():
+    if not app.config['PROFILING']: abort(404)
+    if current_user.role != 'admin': return redirect(url_for('index'))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -201,11 +863,38 @@ def register():
 @login_required
 def logout(): logout_user(); return redirect(url_for('index'))
 
+CLIENT_VIEWS = {'upcoming': 'Nadchodzace', 'history': 'Historia', 'all': 'Wszystkie'}
+STATUS_LABELS = {'oczekuje': 'Oczekuje', 'potwierdzona': 'Potwierdzona', 'zmiana_terminu': 'Zmiana terminu', 'zrealizowana': 'Zakonczona', 'odrzucona': 'Odrzucona'}
+
 @app.route('/client')
 @login_required
 def client_dashboard():
     if current_user.role != 'klient': return redirect(url_for('index'))
-    return render_template('client_dashboard.html', appointments=Appointment.query.filter_by(client_id=current_user.id).order_by(Appointment.date, Appointment.time).all())
+    args = request.args
+    try: d_from, d_to = (parse_day(args[k]) if args.get(k) else None for k in ('from', 'to'))
+    except ValueError: d_from = d_to = None; flash('Daty w formacie RRRR-MM-DD.')
+    # Domyslnie nadchodzace wizyty i propozycje do odpowiedzi (od najblizszej), historia od najnowszej
+    today, view = datetime.now().date(), args.get('view', 'upcoming')
+
+    def where(m):
+        conds = [m.client_id == current_user.id]
+        if args.get('status') in STATUS_LABELS: conds.append(m.status == args['status'])
+        if d_from: conds.append(m.date >= d_from)
+        if d_to: conds.append(m.date <= d_to)
+        if view == 'history': conds.append(m.date < today)
+        elif view != 'all': conds.append((m.date >= today) | (m.status == 'zmiana_terminu'))
+        return conds
+
+    # Strona kluczy po wizytach biezacych i archiwalnych, potem obiekty z obu tabel po id
+    sub = all_appointments(where)
+    keys = [sub.c.date, sub.c.start_min, sub.c.id]
+    page, next_cursor = keyset_page(db.session.query(*keys), keys, parse_cursor(args.get('after'), parse_day, int, int), app.config['CLIENT_PAGE_SIZE'], desc=view == 'history')
+    ids = [r.id for r in page]
+    found = {a.id: a for a in Appointment.query.options(joinedload(Appointment.employee), joinedload(Appointment.service), selectinload(Appointment.review_obj)).filter(Appointment.id.in_(ids))}
+    if len(found) < len(ids):
+        found.update((a.id, a) for a in AppointmentArchive.query.options(joinedload(AppointmentArchive.employee), joinedload(AppointmentArchive.service), selectinload(AppointmentArchive.review_obj)).filter(AppointmentArchive.id.in_([i for i in ids if i not in found])))
+    appointments = [found[i] for i in ids if i in found]
+    return render_template('client_dashboard.html', appointments=appointments, next_cursor=next_cursor, statuses=STATUS_LABELS, views=CLIENT_VIEWS)
 
 @app.route('/client/cancel/<int:id>')
 @login_required
@@ -240,7 +929,16 @@ def admin_panel():
         if 'add_salon' in request.form: db.session.add(Salon(name=request.form.get('name'), address=request.form.get('address'), open_from=request.form.get('open_from'), open_to=request.form.get('open_to'))); db.session.commit()
         elif 'add_manager' in request.form: db.session.add(User(username=request.form.get('username'), password=request.form.get('password'), role='szef', salon_id=request.form.get('salon_id'))); db.session.commit()
         elif 'add_service_global' in request.form: db.session.add(Service(name=request.form.get('name'), price=float(request.form.get('price')), duration=int(request.form.get('duration')), salon_id=request.form.get('salon_id'))); db.session.commit()
-    return render_template('admin.html', salons=Salon.query.all(), users=User.query.all(), services=Service.query.all())
+    args, size = request.args, app.config['ADMIN_PAGE_SIZE']
+    users_q = User.query
+    if args.get('role'): users_q = users_q.filter(User.role == args['role'])
+    if args.get('salon', '').isdigit(): users_q = users_q.filter(User.salon_id == int(args['salon']))
+    if args.get('q'): users_q = users_q.filter(func.lower(User.username).contains(args['q'].lower(), autoescape=True))
+    users, users_next = keyset_page(users_q, [User.id], parse_cursor(args.get('users_after'), int), size)
+    salons, salons_next = keyset_page(Salon.query, [Salon.id], parse_cursor(args.get('salons_after'), int), size)
+    services, services_next = keyset_page(Service.query.options(joinedload(Service.salon)), [Service.id], parse_cursor(args.get('services_after'), int), size)
+    return render_template('admin.html', salon_options=db.session.query(Salon.id, Salon.name).order_by(Salon.id).all(), salons=salons, users=users, services=services,
+                           next_cursors={'users': users_next, 'salons': salons_next, 'services': services_next})
 
 @app.route('/delete/salon/<int:id>')
 @login_required
@@ -264,28 +962,19 @@ def delete_service(id):
 def manager_panel():
     if current_user.role != 'szef': return redirect(url_for('index'))
     my_salon = db.session.get(Salon, current_user.salon_id)
+    staff_q = User.query.filter(User.salon_id == my_salon.id, User.role.in_(['pracownik', 'szef'])); bulk_preview = None
     if request.method == 'POST':
-        if 'add_service' in request.form: db.session.add(Service(name=request.form.get('name'), price=float(request.form.get('price')), duration=int(request.form.get('duration')), salon_id=my_salon.id)); db.session.commit()
+        if 'bulk_schedule' in request.form:
+            chosen = set(request.form.getlist('bulk_employees'))
+            bulk_preview, msg = bulk_schedule_form([m.id for m in staff_q if str(m.id) in chosen])
+            if msg: flash(msg); return redirect(url_for('manager_panel'))
+        elif 'add_service' in request.form: db.session.add(Service(name=request.form.get('name'), price=float(request.form.get('price')), duration=int(request.form.get('duration')), salon_id=my_salon.id)); db.session.commit()
         elif 'add_employee' in request.form: db.session.add(User(username=request.form.get('username'), password=request.form.get('password'), role='pracownik', salon_id=my_salon.id)); db.session.commit()
         elif 'update_hours' in request.form: my_salon.open_from = request.form.get('open_from'); my_salon.open_to = request.form.get('open_to'); db.session.commit()
         elif 'update_margin' in request.form: my_salon.margin_type = request.form.get('margin_type'); my_salon.margin_value = float(request.form.get('margin_value')); db.session.commit()
     
-    apps = Appointment.query.filter_by(salon_id=my_salon.id, status='zrealizowana').all()
-    net = sum((a.service.price * (my_salon.margin_value/100.0) if my_salon.margin_type == 'percent' else my_salon.margin_value) for a in apps if a.service)
-    staff_report = []
-    for m in User.query.filter(User.salon_id == my_salon.id, User.role.in_(['pracownik', 'szef'])).all():
-        ma = Appointment.query.filter_by(employee_id=m.id, status='zrealizowana').all()
-        revs = Review.query.filter_by(employee_id=m.id).all()
-        m_net = 0.0
-        for x in ma:
-             if x.service:
-                 cut = x.service.price * (my_salon.margin_value/100.0) if my_salon.margin_type == 'percent' else my_salon.margin_value
-                 m_net += max(0, x.service.price - cut)
-        upcoming = Appointment.query.filter(Appointment.employee_id == m.id, Appointment.status == 'potwierdzona', Appointment.date >= datetime.now().strftime("%Y-%m-%d")).order_by(Appointment.date).all()
-        staff_report.append({'username': m.username, 'role': m.role, 'gross': sum(x.service.price for x in ma if x.service), 'net': round(m_net,2), 'upcoming': upcoming, 'avg_rating': round(sum(r.rating for r in revs)/len(revs) if revs else 0, 1), 'reviews_count': len(revs)})
-    
-    revs = db.session.query(Review).join(User, Review.employee_id == User.id).filter(User.salon_id == my_salon.id).all()
-    return render_template('manager.html', salon=my_salon, employees=User.query.filter_by(salon_id=my_salon.id, role='pracownik').all(), services=Service.query.filter_by(salon_id=my_salon.id).all(), salon_net_profit=round(net,2), staff_report=staff_report, total_reviews_count=len(revs), salon_avg_rating=round(sum(r.rating for r in revs)/len(revs) if revs else 0, 1))
+    staff = staff_q.all()
+    return render_template('manager.html', salon=my_salon, employees=[m for m in staff if m.role == 'pracownik'], bulk_employees=staff, bulk_preview=bulk_preview, services=Service.query.filter_by(salon_id=my_salon.id).all(), **salon_report(my_salon))
 
 @app.route('/manager/delete/service/<int:id>')
 @login_required
@@ -300,7 +989,100 @@ def manager_delete_employee(id):
     if e and e.salon_id == current_user.salon_id and current_user.role == 'szef': db.session.delete(e); db.session.commit()
     return redirect(url_for('manager_panel'))
 
+@app.route('/export/<int:salon_id>/<fmt>')
+@login_required
+def export_appointments(salon_id, fmt):
+    """Wizyty salonu z przychodem za okres ?from=&to= (opcjonalnie &status=) jako CSV lub JSON, wysylane strumieniowo."""
+    salon = db.session.get(Salon, salon_id)
+    if not salon or not (current_user.role == 'admin' or (current_user.role == 'szef' and current_user.salon_id == salon_id)): return redirect(url_for('index'))
+    if fmt not in ('csv', 'json'): abort(404)
+    try: d_from, d_to = parse_day(request.args['from']), parse_day(request.args['to'])
+    except (KeyError, ValueError): flash('Podaj zakres dat eksportu.'); return redirect(url_for('manager_panel' if current_user.role == 'szef' else 'admin_panel'))
+    rows = export_rows(salon, d_from, d_to, request.args.get('status') or None)
+    body = export_csv(rows) if fmt == 'csv' else export_json(rows)
+    name = f'wizyty_salon{salon_id}_{d_from}_{d_to}.{fmt}'
+    return Response(stream_with_context(body), mimetype='text/csv' if fmt == 'csv' else 'application/json', headers={'Content-Disposition': f'attachment; filename={name}'})
+
+# --- GRAFIK HURTOWY (zakres dat lub powtarzanie, wielu pracownikow naraz) ---
+def bulk_schedule_spec(form):
+    """Dni (zakres + opcjonalnie dni tygodnia) i godziny z formularza; ValueError z komunikatem dla uzytkownika."""
+    try: d_from, d_to = (datetime.strptime(form.get(k, ''), "%Y-%m-%d").date() for k in ('bulk_from', 'bulk_to'))
+    except ValueError: raise ValueError('Podaj zakres dat.')
+    if d_to < d_from or (d_to - d_from).days >= app.config['BULK_SCHEDULE_MAX_DAYS']: raise ValueError(f"Zakres dat: od 1 do {app.config['BULK_SCHEDULE_MAX_DAYS']} dni.")
+    weekdays = {int(w) for w in form.getlist('bulk_weekdays') if w.isdigit()}
+    days = [d for d in date_range(d_from, d_to) if not weekdays or d.weekday() in weekdays]
+    if not days: raise ValueError('Zaden dzien z zakresu nie pasuje do wybranych dni tygodnia.')
+    spec = {'days': days, 'weekdays': weekdays, 'is_working': form.get('is_working') == 'on', 'start_min': None, 'end_min': None, 'break_start_min': None, 'break_end_min': None}
+    if spec['is_working']:
+        try: spec.update({k: to_min(form[f]) if form.get(f) else None for k, f in (('start_min', 'start_time'), ('end_min', 'end_time'), ('break_start_min', 'break_start'), ('break_end_min', 'break_end'))})
+        except ValueError: raise ValueError('Godziny w formacie HH:MM.')
+        if spec['start_min'] is None or spec['end_min'] is None or spec['start_min'] >= spec['end_min']: raise ValueError('Podaj godziny pracy (od wczesniej niz do).')
+        if (spec['break_start_min'] is None) != (spec['break_end_min'] is None) or (spec['break_start_min'] is not None and spec['break_start_min'] >= spec['break_end_min']): raise ValueError('Przerwa wymaga poczatku i pozniejszego konca.')
+    return spec
+
+def bulk_schedule_conflicts(employee_ids, spec):
+    """Aktywne wizyty, ktore wypadlyby poza nowy grafik (dzien wolny, poza godzinami, w przerwie) - jedno zapytanie dla wszystkich dni i pracownikow."""
+    end = Appointment.start_min + Service.duration
+    outside = literal(True)
+    if spec['is_working']:
+        outside = (Appointment.start_min < spec['start_min']) | (end > spec['end_min'])
+        if spec['break_start_min'] is not None: outside = outside | ((Appointment.start_min < spec['break_end_min']) & (end > spec['break_start_min']))
+    return Appointment.query.join(Service, Appointment.service_id == Service.id).options(contains_eager(Appointment.service), joinedload(Appointment.client), joinedload(Appointment.employee)) \
+        .filter(Appointment.employee_id.in_(employee_ids), Appointment.date.in_(spec['days']), Appointment.status.notin_(['odrzucona', 'zrealizowana']), outside) \
+        .order_by(Appointment.date, Appointment.start_min).all()
+
+def apply_bulk_schedule(employee_ids, spec):
+    """Upsert wszystkich dni i pracownikow (INSERT ... ON CONFLICT na _employee_date_uc) w jednej transakcji; zwraca liczbe wierszy."""
+    rows = [{'employee_id': e, 'date': d, 'is_working': spec['is_working'], 'start_min': spec['start_min'], 'end_min': spec['end_min'], 'break_start_min': spec['break_start_min'], 'break_end_min': spec['break_end_min']} for e in employee_ids for d in spec['days']]
+    # Dzien wolny zmienia tylko is_working - godziny zostaja, jak przy edycji pojedynczego dnia
+    cols = ['is_working', 'start_min', 'end_min', 'break_start_min', 'break_end_min'] if spec['is_working'] else ['is_working']
+    upsert = pg_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    it = iter(rows)
+    while chunk := list(islice(it, 500)):
+        stmt = upsert(WorkSchedule).values(chunk)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['employee_id', 'date'], set_={c: stmt.excluded[c] for c in cols}))
+    _drop_capacity(db.session, DayCapacity.employee_id.in_(employee_ids), DayCapacity.date.between(spec['days'][0], spec['days'][-1]))
+    db.session.commit()
+    invalidate_schedules(employee_ids) # upsert przez Core omija zdarzenia sesji
+    return len(rows)
+
+def bulk_schedule_form(employee_ids):
+    """Obsluga formularza: 'preview' -> (dane podgladu dla szablonu, None), zapis lub blad -> (None, komunikat do flash)."""
+    if not employee_ids: return None, 'Wybierz pracownikow.'
+    try: spec = bulk_schedule_spec(request.form)
+    except ValueError as e: return None, str(e)
+    conflicts = bulk_schedule_conflicts(employee_ids, spec)
+    if request.form.get('bulk_action') == 'preview':
+        return {'values': request.form, 'weekdays': spec['weekdays'], 'employee_ids': set(employee_ids), 'days': len(spec['days']), 'conflicts': conflicts}, None
+    n = apply_bulk_schedule(employee_ids, spec)
+    return None, f'Zapisano grafik ({n} wpisow).' + (f' Uwaga: {len(conflicts)} wizyt poza nowym grafikiem.' if conflicts else '')
+
 # --- PRACOWNIK ---
+def build_month_calendar(employee, salon, year, month, today):
+    """Dni kalendarza miesiaca i plan na dzis: jedno zapytanie o wizyty (z klientem i usluga), grupowanie po dacie w jednym przebiegu."""
+    _, num_days = calendar.monthrange(year, month)
+    m_first, m_last = datetime(year, month, 1).date(), datetime(year, month, num_days).date()
+    by_day = defaultdict(list)
+    for a in Appointment.query.options(joinedload(Appointment.client), joinedload(Appointment.service)).filter(Appointment.employee_id == employee.id, Appointment.date.between(m_first, m_last), Appointment.status != 'odrzucona').order_by(Appointment.time, Appointment.id):
+        by_day[a.date].append({'id': a.id, 'time': a.time, 'client': a.client.username, 'service': a.service.name, 'status': a.status})
+    sched = schedules_for([employee])[employee.id]
+
+    cal_days, today_schedule = [], {'is_working': False, 'apps': []}
+    for d in date_range(m_first, m_last):
+        wd = str(d.weekday()); entry = sched['overrides'].get(d.isoformat())
+        iw = False; st, et = salon.open_from, salon.open_to; bs, be = "", ""
+        if entry:
+            iw = entry[0]
+            if iw: st, et, bs, be = fmt_opt(entry[1]), fmt_opt(entry[2]), fmt_opt(entry[3], ""), fmt_opt(entry[4], "")
+        elif wd in sched['days']:
+            iw = True
+            if wd in sched['break_texts']: bs, be = sched['break_texts'][wd]
+
+        day_apps = by_day.get(d, [])
+        if d == today: today_schedule = {'is_working': iw, 'start': st, 'end': et, 'apps': day_apps}
+        cal_days.append({'date': d.isoformat(), 'day': d.day, 'is_working': iw, 'start': st, 'end': et, 'bs': bs, 'be': be, 'has_override': entry is not None, 'appointments': day_apps, 'apps_count': len(day_apps), 'is_today': d == today})
+    return cal_days, today_schedule
+
 @app.route('/employee', methods=['GET', 'POST'])
 @login_required
 def employee_panel():
@@ -309,18 +1091,27 @@ def employee_panel():
     now = datetime.now()
     try: year, month = int(request.args.get('year', now.year)), int(request.args.get('month', now.month))
     except: year, month = now.year, now.month
+    bulk_preview = None
 
     if request.method == 'POST':
-        if 'update_day_schedule' in request.form:
-            d = request.form.get('date_to_edit'); iw = (request.form.get('is_working') == 'on')
-            s = WorkSchedule.query.filter_by(employee_id=current_user.id, date=d).first()
-            if not s: s = WorkSchedule(employee_id=current_user.id, date=d); db.session.add(s)
+        if 'bulk_schedule' in request.form:
+            bulk_preview, msg = bulk_schedule_form([current_user.id])
+            if msg: flash(msg); return redirect(url_for('employee_panel', year=year, month=month))
+        elif 'update_day_schedule' in request.form:
+            d = request.form.get('date_to_edit'); iw = (request.form.get('is_working') == 'on'); day = datetime.strptime(d, "%Y-%m-%d").date()
+            if iw:
+                try: start, end = (to_min(request.form[f]) if request.form.get(f) else None for f in ('start_time', 'end_time'))
+                except ValueError: start = end = None
+                if start is None or end is None or start >= end: flash('Podaj godziny pracy (od wczesniej niz do).'); return redirect(url_for('employee_panel', year=year, month=month))
+            s = WorkSchedule.query.filter_by(employee_id=current_user.id, date=day).first()
+            if not s: s = WorkSchedule(employee_id=current_user.id, date=day); db.session.add(s)
             s.is_working = iw
             if iw: s.start_time = request.form.get('start_time'); s.end_time = request.form.get('end_time'); s.break_start = request.form.get('break_start') or None; s.break_end = request.form.get('break_end') or None
             db.session.commit(); flash(f'Zaktualizowano {d}!'); return redirect(url_for('employee_panel', year=year, month=month))
         elif 'action' in request.form and request.form.get('action') == 'propose_change':
              a = db.session.get(Appointment, request.form.get('appointment_id'))
-             nd, nt = request.form.get('new_date'), request.form.get('new_time')
+             try: nd, nt = parse_day(request.form.get('new_date', '')), request.form.get('new_time', ''); to_min(nt)
+             except ValueError: flash('Podaj nowy termin: data RRRR-MM-DD i godzina HH:MM.'); return redirect(url_for('employee_panel', year=year, month=month))
              if a: 
                  a.proposed_date, a.proposed_time, a.status = nd, nt, 'zmiana_terminu'; db.session.commit(); flash('Wyslano propozycje.')
         elif 'appointment_id' in request.form:
@@ -332,41 +1123,13 @@ def employee_panel():
                  db.session.commit(); flash(f'Status: {a.status}')
     
     # Dane kalendarza
-    _, num_days = calendar.monthrange(year, month)
-    m_str = f"{year}-{month:02d}"
-    scheds = {s.date: s for s in WorkSchedule.query.filter(WorkSchedule.employee_id==current_user.id, WorkSchedule.date.like(f"{m_str}%")).all()}
-    m_apps = Appointment.query.filter(Appointment.employee_id==current_user.id, Appointment.date.like(f"{m_str}%"), Appointment.status!='odrzucona').order_by(Appointment.time).all()
-    defs = current_user.work_days.split(',') if current_user.work_days else []
-    cal_days = []
-    
     today_str = now.strftime("%Y-%m-%d")
-    today_schedule = {'is_working': False, 'apps': []}
-
-    for d in range(1, num_days+1):
-        dt = datetime(year, month, d); d_str = dt.strftime("%Y-%m-%d"); wd = str(dt.weekday())
-        entry = scheds.get(d_str)
-        iw = False; st, et = salon.open_from, salon.open_to; bs, be = "", ""
-        if entry:
-            iw = entry.is_working
-            if iw: st, et, bs, be = entry.start_time, entry.end_time, entry.break_start or "", entry.break_end or ""
-        elif wd in defs:
-            iw = True
-            try: 
-                bj = json.loads(current_user.breaks_json)
-                if wd in bj: bs, be = bj[wd].get('start', ''), bj[wd].get('end', '')
-            except: pass
-        
-        day_apps = [{'id': a.id, 'time': a.time, 'client': a.client.username, 'service': a.service.name, 'status': a.status} for a in m_apps if a.date == d_str]
-        
-        if d_str == today_str:
-            today_schedule = {'is_working': iw, 'start': st, 'end': et, 'apps': day_apps}
-
-        cal_days.append({'date': d_str, 'day': d, 'is_working': iw, 'start': st, 'end': et, 'bs': bs, 'be': be, 'has_override': entry is not None, 'appointments': day_apps, 'apps_count': len(day_apps), 'is_today': (d_str == today_str)})
+    cal_days, today_schedule = build_month_calendar(current_user, salon, year, month, now.date())
 
     prev_m = datetime(year, month, 1) - timedelta(days=1); next_m = datetime(year, month, 28) + timedelta(days=5)
     
-    done = Appointment.query.filter_by(employee_id=current_user.id, status='zrealizowana').all()
-    net = sum(max(0, a.service.price - (a.service.price*(salon.margin_value/100.0) if salon.margin_type=='percent' else salon.margin_value)) for a in done if a.service)
+    done = all_appointments(lambda m: (m.employee_id == current_user.id, m.status == 'zrealizowana'))
+    net = db.session.query(func.coalesce(func.sum(margin_net(salon)), 0)).select_from(done).join(Service, done.c.service_id == Service.id).scalar()
     
     slots = []
     try:
@@ -375,37 +1138,44 @@ def employee_panel():
     except: pass
 
     return render_template('employee.html', 
-        pending_appointments=Appointment.query.filter_by(employee_id=current_user.id, status='oczekuje').all(),
+        pending_appointments=Appointment.query.options(joinedload(Appointment.client), joinedload(Appointment.service)).filter_by(employee_id=current_user.id, status='oczekuje').all(),
         earnings=round(net,2), salon=salon, calendar_days=cal_days, 
         nav={'py': prev_m.year, 'pm': prev_m.month, 'ny': next_m.year, 'nm': next_m.month, 'cm': month, 'cy': year},
-        time_slots=slots, today_schedule=today_schedule, today_date=today_str)
+        time_slots=slots, today_schedule=today_schedule, today_date=today_str, bulk_preview=bulk_preview)
 
 @app.route('/book/date', methods=['GET', 'POST'])
 @login_required
 def booking_date():
     if request.method == 'POST': return redirect(url_for('booking_salon', date=request.form.get('date')))
-    now = datetime.now()
-    try: y, m = int(request.args.get('year', now.year)), int(request.args.get('month', now.month))
-    except: y, m = now.year, now.month
-    
+    now = datetime.now(); today = now.date()
+    try:
+        y, m = int(request.args.get('year', now.year)), int(request.args.get('month', now.month))
+        if not 1 <= m <= 12: raise ValueError
+    except ValueError: y, m = now.year, now.month
+    page = page_fragment('booking_date', (y, m, today), lambda: month_page(y, m, now))
+    d_from, d_to = max(datetime(y, m, 1).date(), today), datetime(y, m, calendar.monthrange(y, m)[1]).date()
+    states, changed = day_states(d_from, d_to) if d_from <= d_to else ({}, data_version()[1])
+    return conditional_page(('booking_date', y, m, today, sorted(states.items())), changed,
+                            lambda: render_template('booking_date.html', days=page['days'], month_options=page['month_options'], states=states))
+
+def month_page(y, m, now):
+    """Lista 12 miesiecy i siatka dni miesiaca dla booking_date - zalezy tylko od (rok, miesiac, dzisiaj)."""
     pl_m = {1:'Styczen',2:'Luty',3:'Marzec',4:'Kwiecien',5:'Maj',6:'Czerwiec',7:'Lipiec',8:'Sierpien',9:'Wrzesien',10:'Pazdziernik',11:'Listopad',12:'Grudzien'}
     opts = []; tmp = now
-    for _ in range(12): opts.append({'name': f"{pl_m[tmp.month]} {tmp.year}", 'y': tmp.year, 'm': tmp.month, 's': (tmp.year==y and tmp.month==m)}); tmp = (datetime(tmp.year+1,1,1) if tmp.month==12 else datetime(tmp.year,tmp.month+1,1))
+    for _ in range(12): opts.append({'name': f"{pl_m[tmp.month]} {tmp.year}", 'value_year': tmp.year, 'value_month': tmp.month, 'selected': (tmp.year==y and tmp.month==m)}); tmp = (datetime(tmp.year+1,1,1) if tmp.month==12 else datetime(tmp.year,tmp.month+1,1))
     
     days = []; _, n = calendar.monthrange(y, m); pl_d = {0:'Pon',1:'Wt',2:'Sr',3:'Czw',4:'Pt',5:'Sob',6:'Niedz'}
     for d in range(1, n+1):
         dt = datetime(y, m, d)
         days.append({'full_date': dt.strftime("%Y-%m-%d"), 'day_name': pl_d[dt.weekday()], 'day_num': d, 'is_weekend': dt.weekday()>=5, 'is_today': dt.date()==now.date(), 'is_past': dt.date()<now.date()})
-    return render_template('booking_date.html', days=days, month_options=opts)
+    return {'days': days, 'month_options': opts}
 
 @app.route('/book/salon/<date>')
 @login_required
 def booking_salon(date):
-    sd = []
-    for s in Salon.query.all():
-        r = db.session.query(Review).join(User, Review.employee_id == User.id).filter(User.salon_id==s.id).all()
-        sd.append({'id': s.id, 'name': s.name, 'address': s.address, 'rating': round(sum(x.rating for x in r)/len(r) if r else 0, 1), 'count': len(r)})
-    return render_template('booking_salon.html', date=date, salons=sd)
+    version = data_version()
+    sd = page_fragment('booking_salon', (), lambda: [{'id': s.id, 'name': s.name, 'address': s.address, 'rating': s.avg_rating, 'count': s.rating_count} for s in Salon.query.all()])
+    return conditional_page(('booking_salon', date, version[0]), version[1], lambda: render_template('booking_salon.html', date=date, salons=sd))
 
 @app.route('/book/service/<date>/<int:salon_id>')
 @login_required
@@ -415,26 +1185,53 @@ def booking_service(date, salon_id): return render_template('booking_service.htm
 @login_required
 def booking_employee(date, salon_id, service_id):
     staff = User.query.filter(User.salon_id == salon_id, User.role.in_(['pracownik', 'szef'])).all()
-    dt = datetime.strptime(date, "%Y-%m-%d"); wd = str(dt.weekday()); lst = []
+    dt = datetime.strptime(date, "%Y-%m-%d").date(); days = app.config['BOOKING_LOOKAHEAD_DAYS']; lst = []
+    ids = [m.id for m in staff]
+    # Grafiki (z cache) i opinie calej obsady na raz zamiast zapytan per pracownik i per dzien
+    scheds = schedules_for(staff)
+    revs_by_emp = latest_reviews(ids, app.config['EMPLOYEE_REVIEWS_SHOWN'])
+
+    def works(m, d):
+        ws = scheds[m.id]['overrides'].get(d.isoformat())
+        if ws: return ws[0]
+        return str(d.weekday()) in scheds[m.id]['days']
+
     for m in staff:
-        revs = Review.query.filter_by(employee_id=m.id).all()
-        ws = WorkSchedule.query.filter_by(employee_id=m.id, date=date).first()
-        wrk = False
-        if ws: wrk = ws.is_working
-        else: wrk = (wd in (m.work_days.split(',') if m.work_days else []))
-        
-        nxt = None
-        if not wrk:
-            for i in range(1, 15):
-                ndt = dt + timedelta(days=i); nstr = ndt.strftime("%Y-%m-%d")
-                nws = WorkSchedule.query.filter_by(employee_id=m.id, date=nstr).first()
-                if nws: 
-                    if nws.is_working: nxt = nstr; break
-                elif str(ndt.weekday()) in (m.work_days.split(',') if m.work_days else []): nxt = nstr; break
-
-        lst.append({'user': m, 'is_working': wrk, 'next_available_date': nxt, 'rating': round(sum(r.rating for r in revs)/len(revs) if revs else 0, 1), 'reviews_count': len(revs), 'reviews_list': revs})
+        revs = revs_by_emp[m.id]
+        wrk = works(m, dt)
+        nxt = None if wrk else next((d.isoformat() for d in date_range(dt + timedelta(days=1), dt + timedelta(days=days)) if works(m, d)), None)
+        lst.append({'user': m, 'is_working': wrk, 'next_available_date': nxt, 'rating': m.avg_rating, 'reviews_count': m.rating_count, 'reviews_list': revs})
     return render_template('booking_employee.html', date=date, salon_id=salon_id, service_id=service_id, employees=lst)
 
+def latest_reviews(employee_ids, n):
+    """{pracownik: n najnowszych opinii} jednym zapytaniem - UNION ALL galezi z LIMIT, kazda idzie wstecz po ix_review_employee_id."""
+    out = defaultdict(list)
+    if not employee_ids: return out
+    latest = union_all(*(select(Review).where(Review.employee_id == e).order_by(Review.id.desc()).limit(n).subquery().select() for e in employee_ids)).subquery()
+    rev = aliased(Review, latest)
+    for r in db.session.query(rev).order_by(latest.c.employee_id, latest.c.id.desc()): out[r.employee_id].append(r)
+    return out
+
+@app.route('/book/first/<date>/<int:salon_id>/<int:service_id>')
+@login_required
+def booking_first(date, salon_id, service_id):
+    s = db.session.get(Salon, salon_id); serv = db.session.get(Service, service_id)
+    if not s or not serv: flash('Nie znaleziono uslugi.'); return redirect(url_for('booking_date'))
+    found = earliest_slots(s, serv, datetime.strptime(date, "%Y-%m-%d").date(), app.config['BOOKING_LOOKAHEAD_DAYS'] + 1, app.config['EARLIEST_SLOTS_LIMIT'])
+    return render_template('booking_first.html', date=date, salon=s, service=serv, found=found, lookahead_days=app.config['BOOKING_LOOKAHEAD_DAYS'])
+
+@app.route('/api/earliest/<int:salon_id>/<int:service_id>')
+@login_required
+def api_earliest(salon_id, service_id):
+    s = db.session.get(Salon, salon_id); serv = db.session.get(Service, service_id)
+    if not s or not serv: return jsonify(error='Nie znaleziono salonu lub uslugi.'), 404
+    try:
+        d_from = datetime.strptime(request.args['from'], "%Y-%m-%d").date() if request.args.get('from') else datetime.now().date()
+        days = int(request.args.get('days', app.config['BOOKING_LOOKAHEAD_DAYS'] + 1)); limit = int(request.args.get('limit', app.config['EARLIEST_SLOTS_LIMIT']))
+    except ValueError: return jsonify(error='Niepoprawne parametry.'), 400
+    if not 0 < days <= app.config['AVAILABILITY_MAX_DAYS'] or not 0 < limit <= 100: return jsonify(error='Niepoprawny zakres.'), 400
+    return jsonify(slots=[{'date': d, 'time': t, 'employee_id': m.id, 'employee': m.username} for d, t, m in earliest_slots(s, serv, d_from, days, limit)])
+
 @app.route('/book/redirect_change_date')
 @login_required
 def redirect_change_date(): flash('Termin niedostepny.'); return redirect(url_for('booking_date'))
@@ -443,18 +1240,157 @@ def redirect_change_date(): flash('Termin niedostepny.'); return redirect(url_fo
 @login_required
 def booking_time(date, salon_id, service_id, employee_id):
     s = db.session.get(Salon, salon_id); serv = db.session.get(Service, service_id); emp = db.session.get(User, employee_id)
-    slots = get_slots_for_day(date, s, serv, emp)
-    nxt = None
-    if not slots:
-        start = datetime.strptime(date, "%Y-%m-%d")
-        for i in range(1, 15):
-            cd = (start + timedelta(days=i)).strftime("%Y-%m-%d")
-            if get_slots_for_day(cd, s, serv, emp): nxt = cd; break
-    if request.method == 'POST': db.session.add(Appointment(date=date, time=request.form.get('time'), client_id=current_user.id, employee_id=emp.id, service_id=serv.id, salon_id=s.id)); db.session.commit(); flash('Zarezerwowano!'); return redirect(url_for('client_dashboard'))
-    return render_template('booking_time.html', date=date, salon=s, service=serv, employee=emp, slots=slots, next_available_date=nxt)
+    start = datetime.strptime(date, "%Y-%m-%d").date(); days = app.config['BOOKING_LOOKAHEAD_DAYS']
+    if request.method == 'POST':
+        chosen = request.form.get('time')
+        booked, free = reserve_slot(start, chosen, s, serv, emp, current_user)
+        if booked: flash('Zarezerwowano!'); return redirect(url_for('client_dashboard'))
+        alt = nearest_slots(free, chosen, app.config['BOOKING_ALTERNATIVES'])
+        flash(f"Termin {chosen} zostal wlasnie zajety. " + (f"Najblizsze wolne godziny: {', '.join(alt)}." if alt else "Tego dnia nie ma juz wolnych godzin."))
+        return redirect(url_for('booking_time', date=date, salon_id=salon_id, service_id=service_id, employee_id=employee_id))
+    # Wybrany dzien i okno szukania nastepnego wolnego terminu - jedno wyliczenie
+    avail = get_availability(s, serv, emp, start, start + timedelta(days=days))
+    slots = avail.pop(start.isoformat())
+    nxt = first_free_date(avail) if not slots else None
+    return render_template('booking_time.html', date=date, salon=s, service=serv, employee=emp, slots=slots, next_available_date=nxt, lookahead_days=days)
+
+@app.route('/api/availability/<int:salon_id>/<int:service_id>/<int:employee_id>')
+@login_required
+def api_availability(salon_id, service_id, employee_id):
+    s = db.session.get(Salon, salon_id); serv = db.session.get(Service, service_id); emp = db.session.get(User, employee_id)
+    if not s or not serv or not emp: return jsonify(error='Nie znaleziono salonu, uslugi lub pracownika.'), 404
+    try:
+        d_from = datetime.strptime(request.args['from'], "%Y-%m-%d").date() if request.args.get('from') else datetime.now().date()
+        d_to = datetime.strptime(request.args['to'], "%Y-%m-%d").date() if request.args.get('to') else d_from + timedelta(days=app.config['BOOKING_LOOKAHEAD_DAYS'])
+    except ValueError: return jsonify(error='Daty w formacie RRRR-MM-DD.'), 400
+    if d_to < d_from or (d_to - d_from).days >= app.config['AVAILABILITY_MAX_DAYS']: return jsonify(error=f"Zakres dat: od 1 do {app.config['AVAILABILITY_MAX_DAYS']} dni."), 400
+    avail = get_availability(s, serv, emp, d_from, d_to)
+    return jsonify({'from': d_from.isoformat(), 'to': d_to.isoformat(), 'duration': serv.duration, 'next_available_date': first_free_date(avail), 'days': avail})
+
+# --- MIGRACJE I KOMENDY CLI ---
+def _hhmm_sql(col):
+    """SQL zamieniajacy tekst 'HH:MM' na minute doby (NULL dla pustych wartosci)."""
+    return f"CASE WHEN {col} IS NULL OR {col} = '' THEN NULL ELSE CAST(substr({col}, 1, instr({col}, ':') - 1) AS INTEGER) * 60 + CAST(substr({col}, instr({col}, ':') + 1) AS INTEGER) END"
+
+# Tabele przebudowywane przy zmianie typow kolumn: {tabela: (kolumna wyznaczajaca nowy schemat, {nowa kolumna: wyrazenie SQL na starych danych})}
+REBUILDS = {
+    'appointment': ('start_min', {'start_min': _hhmm_sql('time'), 'proposed_date': "NULLIF(proposed_date, '')"}),
+    'work_schedule': ('start_min', {'start_min': _hhmm_sql('start_time'), 'end_min': _hhmm_sql('end_time'), 'break_start_min': _hhmm_sql('break_start'), 'break_end_min': _hhmm_sql('break_end')}),
+}
+
+# Indeksy usuniete z modeli (zastapione innymi) - kasowane przy upgrade_db
+DROPPED_INDEXES = ['ix_appointment_status_date']
+
+def _rebuild_table(conn, table, exprs):
+    """Przebudowa tabeli SQLite (nowa tabela, kopia danych z konwersja, podmiana nazwy) - ALTER TABLE nie zmienia typow."""
+    old_cols = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {table.name}_new (", 1))
+    cols = [c.name for c in table.columns if c.name in exprs or c.name in old_cols]
+    conn.exec_driver_sql(f"INSERT INTO {table.name}_new ({', '.join(cols)}) SELECT {', '.join(exprs.get(c, c) for c in cols)} FROM {table.name}")
+    conn.exec_driver_sql(f"DROP TABLE {table.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {table.name}_new RENAME TO {table.name}")
+
+def upgrade_db():
+    """Tworzy brakujace tabele, przebudowuje tabele ze zmienionymi typami kolumn lub bez AUTOINCREMENT, dopisuje brakujace kolumny i indeksy."""
+    with db.engine.begin() as conn: # indeks pojemnosci jest pochodny - ze starszym schematem liczy sie od nowa
+        if inspect(conn).has_table('day_capacity') and 'gaps' not in {c['name'] for c in inspect(conn).get_columns('day_capacity')}: conn.exec_driver_sql('DROP TABLE day_capacity')
+    db.create_all()
+    with db.engine.begin() as conn:
+        for name, (marker, exprs) in REBUILDS.items():
+            if marker not in {c['name'] for c in inspect(conn).get_columns(name)}: _rebuild_table(conn, db.metadata.tables[name], exprs)
+        for table in db.metadata.sorted_tables: # AUTOINCREMENT da sie dodac tylko przebudowa tabeli
+            if conn.dialect.name == 'sqlite' and table.dialect_options['sqlite']['autoincrement'] and 'AUTOINCREMENT' not in conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).scalar().upper(): _rebuild_table(conn, table, {})
+        for name in DROPPED_INDEXES: conn.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+        for table in db.metadata.sorted_tables:
+            have = {c['name'] for c in inspect(conn).get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in have: conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {CreateColumn(col).compile(dialect=db.engine.dialect)}'))
+            for index in table.indexes: index.create(conn, checkfirst=True)
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Aktualizuje schemat bazy do biezacych modeli."""
+    upgrade_db(); print('Schemat bazy aktualny.')
+
+def archive_appointments(older_than_days=None, batch=None):
+    """Przenosi zrealizowane i odrzucone wizyty starsze niz `older_than_days` do appointment_archive partiami (kazda partia w osobnej transakcji); zwraca liczbe wizyt."""
+    cutoff = datetime.now().date() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days)
+    batch, moved = batch or app.config['ARCHIVE_BATCH'], 0
+    with db.engine.begin() as conn: _drop_capacity(conn, DayCapacity.date < datetime.now().date()) # przeszlych dni kalendarz nie pokazuje
+    while True:
+        with db.engine.begin() as conn:
+            ids = conn.execute(select(Appointment.id).where(Appointment.status.in_(['zrealizowana', 'odrzucona']), Appointment.date < cutoff).order_by(Appointment.id).limit(batch)).scalars().all()
+            if not ids: return moved
+            cols = [getattr(Appointment, c) for c in ARCHIVE_COLUMNS]
+            conn.execute(insert(AppointmentArchive).from_select(ARCHIVE_COLUMNS + ['archived_at'], select(*cols, literal(datetime.now().date())).where(Appointment.id.in_(ids))))
+            conn.execute(delete(Appointment).where(Appointment.id.in_(ids)))
+        moved += len(ids)
+
+@app.cli.command('archive-appointments')
+@click.option('--days', type=int, default=None, help='Wiek wizyt w dniach (domyslnie ARCHIVE_AFTER_DAYS).')
+@click.option('--batch', type=int, default=None, help='Wizyt na transakcje (domyslnie ARCHIVE_BATCH).')
+def archive_appointments_command(days, batch):
+    """Przenosi stare zrealizowane/odrzucone wizyty do tabeli archiwum."""
+    print(f'Zarchiwizowano wizyt: {archive_appointments(days, batch)}.')
+
+@app.cli.command('lifecycle')
+@click.option('--loop', 'interval', type=int, default=0, help='Powtarzaj co tyle sekund (worker); bez opcji jeden przebieg.')
+def lifecycle_command(interval):
+    """Wygasza przeterminowane prosby i propozycje, zamyka odbyte potwierdzone wizyty."""
+    while True:
+        print(', '.join(f'{name}: {n}' for name, n in run_lifecycle().items()))
+        if not interval: break
+        time.sleep(interval)
+
+@app.cli.command('clear-capacity')
+def clear_capacity_command():
+    """Czysci indeks DayCapacity (np. po recznych zmianach w bazie) - zostanie policzony od nowa przy odczycie."""
+    with db.engine.begin() as conn: _drop_capacity(conn)
+    print('Wyczyszczono indeks pojemnosci dni.')
+
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    """Przelicza od zera liczniki ocen pracownikow i salonow."""
+    rebuild_ratings(); print('Przeliczono oceny.')
+
+def explain_hot_queries():
+    """Przechodzi gorace trasy jako najbardziej obciazeni pracownik, klient i szef; zwraca [(trasa, ms, sql, plan)] dla kazdego SELECT-a."""
+    busiest = lambda col: db.session.query(col).filter(col.isnot(None)).group_by(col).order_by(func.count().desc()).limit(1).scalar()
+    emp, client = db.session.get(User, busiest(Appointment.employee_id)), db.session.get(User, busiest(Appointment.client_id))
+    if not emp or not client: return []
+    boss = User.query.filter_by(salon_id=emp.salon_id, role='szef').first()
+    day = db.session.query(func.max(Appointment.date)).filter(Appointment.employee_id == emp.id).scalar()
+    serv = Service.query.filter_by(salon_id=emp.salon_id).first()
+    routes = [(client, '/client'), (client, f'/book/employee/{day}/{emp.salon_id}/{serv.id}'), (client, f'/book/time/{day}/{emp.salon_id}/{serv.id}/{emp.id}'), (emp, f'/employee?year={day.year}&month={day.month}')]
+    if boss: routes.append((boss, '/manager'))
+
+    captured = []
+    def before(conn, cursor, statement, parameters, context, executemany): conn.info['t0'] = time.perf_counter()
+    def after(conn, cursor, statement, parameters, context, executemany): captured.append((statement, parameters, (time.perf_counter() - conn.info['t0']) * 1000))
+    out, client_app = [], app.test_client()
+    for user, url in routes:
+        client_app.post('/login', data={'username': user.username, 'password': user.password})
+        event.listen(db.engine, 'before_cursor_execute', before); event.listen(db.engine, 'after_cursor_execute', after)
+        try: client_app.get(url)
+        finally: event.remove(db.engine, 'before_cursor_execute', before); event.remove(db.engine, 'after_cursor_execute', after)
+        for statement, params, ms in captured:
+            if statement.lstrip().upper().startswith('SELECT'):
+                plan = [r[-1] for r in db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params)]
+                out.append((url, ms, statement, plan))
+        captured.clear(); client_app.get('/logout')
+    return out
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """Wypisuje plany (EXPLAIN QUERY PLAN) i czasy zapytan goracych tras; oznacza pelne skany tabel."""
+    for url, ms, statement, plan in explain_hot_queries():
+        full_scan = [p for p in plan if p.startswith('SCAN') and 'INDEX' not in p]
+        print(f"{'!! ' if full_scan else '   '}{ms:8.2f} ms  {url}  {' '.join(statement.split())[:110]}")
+        for p in plan: print(f"              {p}")
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_db()
         if not User.query.filter_by(username='admin').first(): db.session.add(User(username='admin', password='admin', role='admin')); db.session.commit()
     app.run(debug=True)
\ No newline at end of file
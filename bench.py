@@ -0,0 +1,112 @@
+"""Benchmark tras: kazda trasa przez test client Flaska jako zalogowany klient, pracownik, szef i admin.
+
+Uzycie: python bench.py instance/seed.db [--runs 20] [--out bench.json] [--compare poprzedni.json]
+Dla kazdej trasy: percentyle czasu odpowiedzi (ms) i liczba zapytan SQL. Z --compare wypisuje roznice
+wzgledem zapisanego wyniku i konczy sie kodem 1, gdy mediana urosla ponad --threshold albo przybylo zapytan."""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from datetime import date, datetime, timedelta
+
+ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+ap.add_argument('path', help='plik SQLite (np. z seed.py)')
+ap.add_argument('--runs', type=int, default=20)
+ap.add_argument('--warmup', type=int, default=2)
+ap.add_argument('--date', help='dzien rezerwacji RRRR-MM-DD (domyslnie jutro)')
+ap.add_argument('--cold-cache', action='store_true', help='czysc cache grafikow i stron przed kazdym pomiarem')
+ap.add_argument('--out', help='zapisz wynik jako JSON')
+ap.add_argument('--compare', help='porownaj z wczesniejszym wynikiem JSON')
+ap.add_argument('--threshold', type=float, default=1.25, help='dopuszczalny wzrost mediany przy --compare (1.25 = +25%%)')
+args = ap.parse_args()
+
+if not os.path.exists(args.path): sys.exit(f'Brak pliku {args.path} - utworz go przez seed.py.')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.path)
+
+from sqlalchemy import event, func
+from app import app, db, schedule_cache, page_cache, User, Appointment, Service
+
+
+def percentile(values, p):
+    """Percentyl metoda najblizszej pozycji (values posortowane)."""
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def pick_routes(day):
+    """[(nazwa, rola, (login, haslo), url)] dla najbardziej obciazonych pracownika i klienta."""
+    busiest = lambda col: db.session.query(col).filter(col.isnot(None)).group_by(col).order_by(func.count().desc()).limit(1).scalar()
+    emp, client = db.session.get(User, busiest(Appointment.employee_id)), db.session.get(User, busiest(Appointment.client_id))
+    if not emp or not client: sys.exit('Baza bez wizyt - utworz ja przez seed.py.')
+    boss = User.query.filter_by(salon_id=emp.salon_id, role='szef').first()
+    admin = User.query.filter_by(role='admin').first()
+    serv = Service.query.filter_by(salon_id=emp.salon_id).first()
+    d, sal = day.isoformat(), emp.salon_id
+    routes = [('client_dashboard', client, '/client'), ('booking_date', client, '/book/date'), ('booking_salon', client, f'/book/salon/{d}'),
+              ('booking_service', client, f'/book/service/{d}/{sal}'), ('booking_employee', client, f'/book/employee/{d}/{sal}/{serv.id}'),
+              ('booking_time', client, f'/book/time/{d}/{sal}/{serv.id}/{emp.id}'), ('booking_first', client, f'/book/first/{d}/{sal}/{serv.id}'),
+              ('api_availability', client, f'/api/availability/{sal}/{serv.id}/{emp.id}?from={d}'), ('api_earliest', client, f'/api/earliest/{sal}/{serv.id}?from={d}'),
+              ('employee_panel', emp, f'/employee?year={day.year}&month={day.month}')]
+    if boss: routes.append(('manager_panel', boss, '/manager'))
+    if admin: routes.append(('admin_panel', admin, '/admin'))
+    return [(name, user.role, (user.username, user.password), url) for name, user, url in routes]
+
+
+def measure(routes):
+    sql = [0]
+    def count(conn, cursor, statement, parameters, context, executemany): sql[0] += 1
+    client, out = app.test_client(), {}
+    with app.app_context(): engine = db.engine
+    for name, role, (username, password), url in routes:
+        client.post('/login', data={'username': username, 'password': password})
+        for _ in range(args.warmup): client.get(url)
+        times, counts = [], []
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            for _ in range(args.runs):
+                if args.cold_cache: schedule_cache.clear(); page_cache.clear()
+                sql[0] = 0; t0 = time.perf_counter(); r = client.get(url)
+                times.append((time.perf_counter() - t0) * 1000); counts.append(sql[0])
+        finally: event.remove(engine, 'before_cursor_execute', count)
+        times.sort()
+        out[name] = {'role': role, 'url': url, 'status': r.status_code, 'sql': max(counts), 'mean_ms': round(statistics.mean(times), 2),
+                     **{f'p{p}_ms': round(percentile(times, p), 2) for p in (50, 90, 99)}, 'max_ms': round(times[-1], 2)}
+        client.get('/logout')
+    return out
+
+
+def compare(result, baseline):
+    """Wypisuje roznice wzgledem wczesniejszego wyniku; zwraca liczbe regresji."""
+    regressions = 0
+    print(f"\n{'trasa':<18} {'p50 teraz':>10} {'p50 wczesniej':>14} {'zmiana':>8} {'sql':>9}")
+    for name, now in result['routes'].items():
+        old = baseline['routes'].get(name)
+        if not old: print(f'{name:<18} {now["p50_ms"]:>10.2f} {"-":>14}'); continue
+        ratio = now['p50_ms'] / old['p50_ms'] if old['p50_ms'] else 1.0
+        bad = ratio > args.threshold or now['sql'] > old['sql']
+        regressions += bad
+        print(f"{name:<18} {now['p50_ms']:>10.2f} {old['p50_ms']:>14.2f} {(ratio - 1) * 100:>+7.0f}% {old['sql']:>4}->{now['sql']:<4}{'  !!' if bad else ''}")
+    return regressions
+
+
+def main():
+    day = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else date.today() + timedelta(days=1)
+    with app.app_context(): routes = pick_routes(day)
+    result = {'meta': {'db': os.path.abspath(args.path), 'date': day.isoformat(), 'runs': args.runs, 'cold_cache': args.cold_cache,
+                       'python': platform.python_version(), 'created': datetime.now().isoformat(timespec='seconds')},
+              'routes': measure(routes)}
+    print(f"{'trasa':<18} {'rola':<10} {'p50':>8} {'p90':>8} {'p99':>8} {'sql':>5}  url")
+    for name, r in result['routes'].items():
+        print(f"{name:<18} {r['role']:<10} {r['p50_ms']:>8.2f} {r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['sql']:>5}  {r['url']}" + ('' if r['status'] == 200 else f"  (HTTP {r['status']})"))
+    if args.out:
+        with open(args.out, 'w') as f: json.dump(result, f, indent=2)
+        print(f'\nZapisano {args.out}')
+    if args.compare:
+        with open(args.compare) as f: return 1 if compare(result, json.load(f)) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Generator danych testowych: salony, obsada, uslugi, miesiace wizyt, opinie i nadpisania grafiku (WorkSchedule).
+
+Uzycie: python seed.py instance/seed.db [--salons 5] [--staff 4] [--clients 500] [--months-back 6] [--months-ahead 1] ...
+Loginy: admin/admin, szef<s>/x, prac<s>_<k>/x, klient<i>/x. Wizyty jednego pracownika nigdy sie nie nakladaja."""
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import date, timedelta
+
+ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+ap.add_argument('path', help='plik SQLite do utworzenia')
+ap.add_argument('--force', action='store_true', help='nadpisz istniejacy plik')
+ap.add_argument('--seed', type=int, default=42)
+ap.add_argument('--salons', type=int, default=5)
+ap.add_argument('--staff', type=int, default=4, help='pracownikow na salon (poza szefem)')
+ap.add_argument('--services', type=int, default=6, help='uslug na salon')
+ap.add_argument('--clients', type=int, default=500)
+ap.add_argument('--months-back', type=int, default=6)
+ap.add_argument('--months-ahead', type=int, default=1)
+ap.add_argument('--fill', type=float, default=0.6, help='jaka czesc czasu pracy jest zarezerwowana (0-1)')
+ap.add_argument('--review-rate', type=float, default=0.3, help='jaka czesc zrealizowanych wizyt ma opinie')
+ap.add_argument('--override-rate', type=float, default=0.1, help='jaka czesc dni pracownika ma wpis WorkSchedule')
+args = ap.parse_args()
+
+path = os.path.abspath(args.path)
+if os.path.exists(path):
+    if not args.force: sys.exit(f'{path} istnieje - uzyj --force, zeby nadpisac.')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+os.environ['DATABASE_URL'] = 'sqlite:///' + path
+
+from app import app, db, upgrade_db, rebuild_ratings, fmt_min, Salon, Service, User, Appointment, Review, WorkSchedule
+
+BATCH = 5000
+rnd = random.Random(args.seed)
+today = date.today()
+d_from, d_to = today - timedelta(days=30 * args.months_back), today + timedelta(days=30 * args.months_ahead)
+counts = dict.fromkeys(['salon', 'service', 'user', 'appointment', 'review', 'work_schedule'], 0)
+
+
+def insert(model, rows):
+    """Hurtowy INSERT przez Core (bez zdarzen ORM - liczniki ocen przelicza rebuild_ratings na koncu)."""
+    if rows: db.session.execute(model.__table__.insert(), rows); counts[model.__tablename__] += len(rows); rows.clear()
+
+
+def day_plan(emp, d):
+    """(start, koniec, przerwa) pracownika w minutach albo None; przy okazji losuje nadpisanie grafiku."""
+    if rnd.random() < args.override_rate:
+        working = rnd.random() < 0.8
+        start, end = rnd.choice([8, 9, 10, 11]) * 60, rnd.choice([15, 16, 17, 18]) * 60
+        brk = (13 * 60, 13 * 60 + 30) if working and rnd.random() < 0.5 else (None, None)
+        schedules.append({'employee_id': emp['id'], 'date': d, 'is_working': working, 'start_min': start if working else None, 'end_min': end if working else None, 'break_start_min': brk[0], 'break_end_min': brk[1]})
+        return (start, end, brk) if working else None
+    if str(d.weekday()) not in emp['work_days'].split(','): return None
+    salon = salons[emp['salon_id'] - 1]
+    brk = json.loads(emp['breaks_json']).get(str(d.weekday()))
+    return salon['open_min'], salon['close_min'], (brk['start_min'], brk['end_min']) if brk else (None, None)
+
+
+with app.app_context():
+    upgrade_db()
+    salons, services, staff = [], {}, []
+    for s in range(1, args.salons + 1):
+        open_min, close_min = rnd.choice([8, 9, 10]) * 60, rnd.choice([17, 18, 20]) * 60
+        salons.append({'id': s, 'name': f'Salon {s}', 'address': f'ul. Testowa {s}', 'open_from': fmt_min(open_min), 'open_to': fmt_min(close_min),
+                       'margin_type': rnd.choice(['percent', 'fixed']), 'margin_value': rnd.choice([10.0, 15.0, 20.0]), 'open_min': open_min, 'close_min': close_min})
+    insert(Salon, [{k: v for k, v in s.items() if not k.endswith('_min')} for s in salons])
+
+    no_staff = {'salon_id': None, 'work_days': '0,1,2,3,4', 'breaks_json': '{}'}
+    users, uid, sid = [dict(no_staff, id=1, username='admin', password='admin', role='admin')], 2, 1
+    for salon in salons:
+        for k in range(args.staff + 1):
+            lunch = rnd.randrange(12 * 60, 14 * 60, 30)
+            breaks = {str(wd): {'start': fmt_min(lunch), 'end': fmt_min(lunch + 30)} for wd in range(5) if rnd.random() < 0.5}
+            emp = {'id': uid, 'username': f"szef{salon['id']}" if k == 0 else f"prac{salon['id']}_{k}", 'password': 'x', 'role': 'szef' if k == 0 else 'pracownik',
+                   'salon_id': salon['id'], 'work_days': ','.join(str(wd) for wd in range(7) if rnd.random() < (0.9 if wd < 5 else 0.3)), 'breaks_json': json.dumps(breaks)}
+            users.append(emp); staff.append(dict(emp, breaks_json=json.dumps({wd: {'start_min': lunch, 'end_min': lunch + 30} for wd in breaks}))); uid += 1
+        for k in range(args.services):
+            duration = rnd.choice([15, 30, 45, 60, 90, 120])
+            services.setdefault(salon['id'], []).append({'id': sid, 'name': f'Usluga {k + 1} ({duration} min)', 'duration': duration, 'price': float(duration * rnd.randint(1, 4)), 'salon_id': salon['id']}); sid += 1
+    clients = list(range(uid, uid + args.clients))
+    users += [dict(no_staff, id=c, username=f'klient{c - uid}', password='x', role='klient') for c in clients]
+    insert(User, users); insert(Service, [s for lst in services.values() for s in lst])
+
+    appointments, reviews, schedules, aid = [], [], [], 1
+    for emp in staff:
+        d = d_from
+        while d <= d_to:
+            plan = day_plan(emp, d)
+            if plan:
+                t, end, (bs, be) = plan
+                while t < end:
+                    if bs is not None and bs <= t < be: t = be; continue
+                    serv = rnd.choice(services[emp['salon_id']])
+                    fits = t + serv['duration'] <= end and (bs is None or t + serv['duration'] <= bs or t >= be)
+                    if not fits or rnd.random() > args.fill: t += 15; continue
+                    if d < today: status = 'zrealizowana' if rnd.random() < 0.85 else 'odrzucona'
+                    else: status = rnd.choices(['oczekuje', 'potwierdzona', 'zmiana_terminu'], [3, 6, 1])[0]
+                    row = {'id': aid, 'date': d, 'start_min': t, 'status': status, 'client_id': rnd.choice(clients), 'employee_id': emp['id'], 'service_id': serv['id'], 'salon_id': emp['salon_id'], 'proposed_date': None, 'proposed_time': None}
+                    if status == 'zmiana_terminu': row.update(proposed_date=d + timedelta(days=rnd.randint(1, 7)), proposed_time=fmt_min(t))
+                    appointments.append(row)
+                    if status == 'zrealizowana' and rnd.random() < args.review_rate:
+                        reviews.append({'rating': rnd.choices([1, 2, 3, 4, 5], [1, 1, 3, 6, 9])[0], 'comment': 'Opinia testowa', 'created_at': d.isoformat(), 'appointment_id': aid, 'client_id': row['client_id'], 'employee_id': emp['id']})
+                    aid += 1; t += serv['duration']
+            d += timedelta(days=1)
+            if len(appointments) >= BATCH: insert(Appointment, appointments); insert(Review, reviews); insert(WorkSchedule, schedules)
+    insert(Appointment, appointments); insert(Review, reviews); insert(WorkSchedule, schedules)
+    db.session.commit()
+    rebuild_ratings()
+
+print(f'Baza: {path}  ({d_from} .. {d_to})')
+for table, n in counts.items(): print(f'  {table:<14} {n:>9}')
@@ -0,0 +1,82 @@
+"""Test obciazeniowy sciezki rezerwacji: setki watkow jednoczesnie rezerwuja terminy u jednego pracownika.
+
+Uzycie: python stress_booking.py [--threads 300] [--hot 10] [--duration 30]
+Dziala na tymczasowej bazie (DATABASE_URL ustawiany przed importem aplikacji). Konczy sie kodem 1,
+jesli jakiekolwiek wizyty pracownika nakladaja sie na siebie."""
+import os
+import sys
+import random
+import argparse
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+tmp_dir = tempfile.mkdtemp(prefix='stress_booking_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp_dir, 'stress.db')
+
+from app import app, db, upgrade_db, get_slots_for_day, User, Salon, Service, Appointment
+
+
+def seed(n_clients, duration):
+    with app.app_context():
+        upgrade_db()
+        salon = Salon(name='Stress', address='-', open_from='08:00', open_to='20:00')
+        db.session.add(salon); db.session.flush()
+        service = Service(name='Strzyzenie', duration=duration, price=50.0, salon_id=salon.id)
+        employee = User(username='pracownik', password='x', role='pracownik', salon_id=salon.id, work_days='0,1,2,3,4,5,6')
+        db.session.add_all([service, employee] + [User(username=f'klient{i}', password='x', role='klient') for i in range(n_clients)])
+        db.session.commit()
+        day = date.today() + timedelta(days=7)
+        return salon.id, service.id, employee.id, day, get_slots_for_day(day.isoformat(), salon, service, employee)
+
+
+def overlaps(employee_id, day):
+    """Pary wizyt pracownika (id, id), ktore zachodza na siebie w danym dniu."""
+    with app.app_context():
+        rows = db.session.query(Appointment.id, Appointment.start_min, Service.duration).join(Service, Service.id == Appointment.service_id) \
+            .filter(Appointment.employee_id == employee_id, Appointment.date == day).order_by(Appointment.start_min).all()
+    return [(a.id, b.id) for a, b in zip(rows, rows[1:]) if a.start_min + a.duration > b.start_min]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--threads', type=int, default=300)
+    ap.add_argument('--hot', type=int, default=10, help='ile pierwszych godzin dnia losuja watki (mniej = wiecej konfliktow)')
+    ap.add_argument('--duration', type=int, default=30, help='dlugosc uslugi w minutach')
+    args = ap.parse_args()
+
+    salon_id, service_id, employee_id, day, slots = seed(args.threads, args.duration)
+    url = f'/book/time/{day.isoformat()}/{salon_id}/{service_id}/{employee_id}'
+    clients = []
+    for i in range(args.threads):
+        c = app.test_client(); c.post('/login', data={'username': f'klient{i}', 'password': 'x'}); clients.append(c)
+
+    barrier, results, lock = threading.Barrier(args.threads + 1), [], threading.Lock()
+
+    def worker(c, chosen):
+        barrier.wait()
+        t0 = time.perf_counter(); r = c.post(url, data={'time': chosen}); ms = (time.perf_counter() - t0) * 1000
+        with lock: results.append((r.status_code, r.headers.get('Location', ''), ms))
+
+    rnd = random.Random(0)
+    threads = [threading.Thread(target=worker, args=(c, rnd.choice(slots[:args.hot]))) for c in clients]
+    for t in threads: t.start()
+    barrier.wait(); t0 = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+
+    booked = sum(1 for code, loc, _ in results if code == 302 and loc.endswith('/client'))
+    taken = sum(1 for code, loc, _ in results if code == 302 and loc.endswith(url))
+    errors = len(results) - booked - taken
+    lat = sorted(ms for *_, ms in results)
+    bad = overlaps(employee_id, day)
+    print(f'Baza: {os.environ["DATABASE_URL"]}')
+    print(f'Proby: {len(results)} w {elapsed:.2f} s -> {len(results) / elapsed:.0f} rezerwacji/s (p50 {lat[len(lat) // 2]:.0f} ms, p99 {lat[int(len(lat) * 0.99)]:.0f} ms)')
+    print(f'Zarezerwowano: {booked}, termin zajety: {taken}, bledy: {errors}')
+    print(f'Nakladajace sie wizyty: {len(bad)}' + (f' {bad[:10]}' if bad else ''))
+    return 1 if bad or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
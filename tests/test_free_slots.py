@@ -0,0 +1,59 @@
+"""Parytet silnika przedzialow (free_slots + past_cutoff) ze starym skanowaniem co 5 minut z get_slots_for_day."""
+import random
+from datetime import date, datetime, timedelta
+
+from app import SLOT_STEP, free_slots, past_cutoff
+
+DAY = date(2026, 3, 10)
+
+
+def reference_slots(window, busy, duration, day, now):
+    """Stara petla get_slots_for_day na minutach doby: kandydat co 5 minut od poczatku zmiany,
+    odrzucany gdy dzis juz minal, nachodzi na przerwe albo na inna wizyte."""
+    start, end, brk = window
+    base = datetime.combine(day, datetime.min.time())
+    at = lambda m: base + timedelta(minutes=m)
+    slots, curr, dur = [], at(start), timedelta(minutes=duration)
+    while curr + dur <= at(end):
+        ns, ne = curr, curr + dur
+        free = not (day == now.date() and ns.time() <= now.time())
+        if free and brk and max(ns, at(brk[0])) < min(ne, at(brk[1])): free = False
+        if free and any(ns < at(e) and ne > at(s) for s, e in busy): free = False
+        if free: slots.append(int((curr - base).total_seconds()) // 60)
+        curr += timedelta(minutes=5)
+    return slots
+
+
+def random_case(rnd):
+    start = rnd.randrange(0, 1380)
+    end = rnd.randrange(start + 1, 1441)
+    kind = rnd.choice(['none', 'normal', 'zero', 'inverted', 'outside'])
+    b = rnd.randrange(start, end + 1)
+    brk = {'none': None, 'normal': (b, min(1440, b + rnd.randrange(1, 120))), 'zero': (b, b),
+           'inverted': (b, max(0, b - rnd.randrange(1, 60))), 'outside': (max(0, start - 60), start)}[kind]
+    busy, t = [], rnd.randrange(max(0, start - 60), end + 1)
+    for _ in range(rnd.randrange(0, 8)):
+        length = rnd.choice([0, 5, 15, 30, 45, 60, rnd.randrange(1, 121)])
+        busy.append((t, t + length))
+        # nastepna wizyta styka sie z poprzednia, nachodzi na nia albo zaczyna gdziekolwiek w oknie
+        t = rnd.choice([t + length, max(0, t + length - rnd.randrange(1, 30)), rnd.randrange(max(0, start - 60), end + 1)])
+    rnd.shuffle(busy)
+    duration = rnd.choice([0, 5, 15, 30, 45, 60, 90, rnd.randrange(1, 181)])
+    now = datetime.combine(DAY + timedelta(days=rnd.choice([-1, 0, 0, 0, 1])), datetime.min.time()) \
+        + timedelta(minutes=rnd.randrange(0, 1440), seconds=rnd.randrange(0, 60), microseconds=rnd.randrange(0, 10 ** 6))
+    return (start, end, brk), busy, duration, now
+
+
+def test_free_slots_matches_reference_scan():
+    assert SLOT_STEP == 5
+    rnd = random.Random(20260310)
+    for _ in range(10000):
+        window, busy, duration, now = random_case(rnd)
+        expected = reference_slots(window, busy, duration, DAY, now)
+        assert free_slots(window, list(busy), duration, past_cutoff(DAY, now)) == expected, (window, busy, duration, now)
+
+
+def test_now_with_seconds_excludes_current_minute():
+    now = datetime.combine(DAY, datetime.min.time()) + timedelta(hours=10, minutes=5, seconds=30)
+    window = (600, 660, None)
+    assert free_slots(window, [], 15, past_cutoff(DAY, now)) == reference_slots(window, [], 15, DAY, now) == [610, 615, 620, 625, 630, 635, 640, 645]